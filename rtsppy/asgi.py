@@ -13,11 +13,18 @@ from channels.routing import ProtocolTypeRouter, URLRouter
 # from channels.auth import AuthMiddlewareStack
 # from channels.security.websocket import AllowedHostsOriginValidator
 import stream.routing
+from stream.utils.stream_prober import get_stream_prober
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'rtsppy.settings')
 
+django_application = get_asgi_application()
+
+# Keeps source metadata fresh and finds dead cameras before viewers do. Started here,
+# not in AppConfig.ready(), so management commands and pipeline workers don't probe
+get_stream_prober().start()
+
 application = ProtocolTypeRouter({
-    "http": get_asgi_application(),
+    "http": django_application,
     "websocket": URLRouter(
             stream.routing.websocket_urlpatterns
         )
@@ -150,6 +150,41 @@ CHANNEL_LAYERS = {
     }
 }
 
+# Stream pipelines
+# Number of worker processes to shard stream pipelines across, 0 runs them as
+# threads inside the ASGI process (bound to one core by the GIL)
+STREAM_WORKER_PROCESSES = 0
+
+# With no viewers a pipeline keeps draining ffmpeg's output, stops ffmpeg after
+# STREAM_IDLE_SUSPEND_AFTER seconds (restarted with the known transport when a
+# viewer returns) and tears down after STREAM_IDLE_TEARDOWN_AFTER
+STREAM_IDLE_SUSPEND_AFTER = 10.0
+STREAM_IDLE_TEARDOWN_AFTER = 120.0
+
+# Background ffprobe of all active streams, results are cached on the Stream.
+# A stream whose last probe or connect failed is not retried by viewer connects
+# for STREAM_DEAD_RETRY_AFTER seconds. STREAM_PROBE_INTERVAL = 0 disables the
+# background prober, `manage.py probe_streams` still works.
+STREAM_PROBE_INTERVAL = 300.0
+STREAM_PROBE_WORKERS = 8
+STREAM_PROBE_TIMEOUT = 10.0
+STREAM_DEAD_RETRY_AFTER = 60.0
+
+# Under CPU pressure pipelines give up detection rate, JPEG quality and fps, lowest
+# priority first. Shedding starts above LOAD_SHEDDING_HIGH host CPU usage (0-1) and
+# is undone below LOAD_SHEDDING_LOW.
+LOAD_SHEDDING_ENABLED = True
+LOAD_SHEDDING_HIGH = 0.9
+LOAD_SHEDDING_LOW = 0.6
+
+# Face embeddings, an OpenCV DNN model such as OpenFace nn4.small2.v1.t7.
+# Streams with embeddings_enabled match detected faces against the gallery,
+# which is memory-mapped from FACE_GALLERY_PATH on startup.
+FACE_EMBEDDING_MODEL = None
+FACE_EMBEDDING_INPUT_SIZE = (96, 96)
+FACE_EMBEDDING_DIM = 128
+FACE_GALLERY_PATH = BASE_DIR / 'face_gallery'
+
 # REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
@@ -18,13 +18,14 @@ import os
 from django.contrib import admin
 from django.urls import path, include, re_path
 from rest_framework.routers import DefaultRouter
-from stream.views import StreamViewSet
+from stream.views import StreamViewSet, FaceGalleryViewSet
 from drf_spectacular.views import SpectacularAPIView, SpectacularRedocView, SpectacularSwaggerView
 from django.views.static import serve
 
 # Create a router for REST API
 router = DefaultRouter()
 router.register(r'streams', StreamViewSet)
+router.register(r'faces', FaceGalleryViewSet, basename='face')
 FRONTEND_DIST = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'ui', 'dist')
 
 print("AYOAYOAYOAOY" , FRONTEND_DIST)
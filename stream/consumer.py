@@ -1,12 +1,19 @@
 # streams/consumers.py
 from channels.generic.websocket import AsyncWebsocketConsumer
 import json
-from .utils.rtsp_client import RTSPClient
+from .utils.rtsp_client import RTSPClient, PREVIEW_MODE
+from .utils.frame_trace import FrameTrace, log_sampled
+from .utils.rate_limit import FrameRateLimiter, parse_max_fps
+from .utils.worker_pool import get_worker_pool
+from django.conf import settings
 from .models import Stream
 from asgiref.sync import sync_to_async
 import logging
 import threading
 import asyncio
+import struct
+import time
+from urllib.parse import parse_qs
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -17,31 +24,123 @@ active_streams : dict[str, RTSPClient] = {}
 
 # Background task to clean up streams that should be removed
 async def cleanup_streams():
-    """Periodically check and remove streams marked for removal"""
+    """Periodically remove streams whose pipelines have torn down after being idle"""
     while True:
         logger.info(f"Periodic cleanup of streams")
-        await asyncio.sleep(30)  # Check every 5 seconds
+        await asyncio.sleep(30)  # Check every 30 seconds
         to_remove = []
         for stream_id, client in active_streams.items():
-            if client.client_count == 0:
+            # Idle pipelines stay registered so a returning viewer resumes them
+            if client.client_count == 0 and not client.is_running:
                 to_remove.append(stream_id)
         
         for stream_id in to_remove:
-            logger.info(f"Cleanup: Removing stream {stream_id} from active streams")
-            if active_streams[stream_id]:
-                logger.info(f"Shutting down stream {stream_id} with client count {active_streams[stream_id].client_count}")
-                active_streams[stream_id]._shutdown()
             logger.info(f"Deleting stream {stream_id} from active streams")
             del active_streams[stream_id]
 
+def stream_group_name(stream_id):
+    return f'stream_{stream_id}'
+
+# Preview pipelines run next to the full one of the same stream, registered under their own key
+PREVIEW_SUFFIX = f'-{PREVIEW_MODE}'
+
+def parse_mode(value):
+    return PREVIEW_MODE if value == PREVIEW_MODE else 'full'
+
+def pipeline_key(stream_id, mode='full'):
+    """Key in active_streams, also the stream_id the pipeline's events carry"""
+    return f'{stream_id}{PREVIEW_SUFFIX}' if mode == PREVIEW_MODE else stream_id
+
+def stream_id_of(key):
+    return key.removesuffix(PREVIEW_SUFFIX)
+
+def ensure_cleanup_task():
+    """Make sure cleanup task is running"""
+    for task in asyncio.all_tasks():
+        if task.get_name() == 'cleanup_streams':
+            break
+    else:
+        # Start cleanup task if not already running
+        cleanup_task = asyncio.create_task(cleanup_streams())
+        cleanup_task.set_name('cleanup_streams')
+
+class StreamUnreachable(Exception):
+    pass
+
+async def acquire_stream(stream_id, mode='full'):
+    """
+    Register a viewer on a stream's full or preview pipeline, starting its RTSPClient if needed.
+    Returns (client, started), raises Stream.DoesNotExist for unknown or inactive streams
+    and StreamUnreachable for streams that recently failed to probe or connect.
+    """
+    stream = await sync_to_async(Stream.objects.get)(id=stream_id, is_active=True)
+
+    key = pipeline_key(stream_id, mode)
+    client = active_streams.get(key)
+    if not (client and client.is_running):
+        retry_after = getattr(settings, 'STREAM_DEAD_RETRY_AFTER', 60.0)
+        if stream.recently_unreachable(retry_after):
+            raise StreamUnreachable(stream.probe_error or 'Stream unreachable')
+
+    if client:
+        # start() resumes an idle pipeline, or restarts one that has torn down
+        started = not client.is_running
+        if started:
+            # Pick up source metadata probed since the pipeline last ran
+            client.reconfigure(stream.url, stream.pipeline_config(mode))
+        client.start()
+        return client, started
+
+    pool = get_worker_pool()
+    if pool:
+        client = pool.create_client(key, stream.url, stream_group_name(key), stream.pipeline_config(mode))
+    else:
+        client = RTSPClient(key, stream.url, stream_group_name(key), stream.pipeline_config(mode))
+    active_streams[key] = client
+    client.start()
+    ensure_cleanup_task()
+    return client, True
+
+async def release_stream(key):
+    """Unregister a viewer from a pipeline, key as returned by pipeline_key"""
+    def remove_client():
+        client = active_streams.get(key)
+        if client is None:
+            return
+        # Stays registered while idle, cleanup_streams removes it after teardown
+        client.remove_client()
+
+    await sync_to_async(remove_client)()
+
+def buffered_frame_message(client):
+    """Latest frame of a running stream with its trace header, None if there is none yet"""
+    frame, buffered_trace = client.frame_buffer, client.frame_buffer_trace
+    if not frame or not buffered_trace:
+        return None
+    trace = FrameTrace(buffered_trace.seq, buffered_trace.stamps)
+    trace.mark('sent')
+    return trace.pack_header() + frame
+
 class RTSPConsumer(AsyncWebsocketConsumer):
+    """
+    One stream per WebSocket. A viewer that needs fewer frames than the stream
+    produces connects with ?max_fps=2 or sends {"type": "set_max_fps", "max_fps": 2},
+    0 or no value means every frame. ?mode=preview joins the stream's keyframe-only
+    thumbnail pipeline instead.
+    """
+
     async def connect(self):
         """Handle new client connection"""
         logger.info('RTSP Consumer connect initiated')
         
         self.stream_id = self.scope['url_route']['kwargs']['stream_id']
+        query = parse_qs(self.scope.get('query_string', b'').decode(errors='ignore'))
+        self.mode = parse_mode(query.get('mode', [None])[0])
+        self.pipeline_key = pipeline_key(self.stream_id, self.mode)
 
-        self.group_name = f'stream_{self.stream_id}'
+        self.group_name = stream_group_name(self.pipeline_key)
+        self.joined = False
+        self.limiter = FrameRateLimiter(parse_max_fps(query.get('max_fps', [None])[0]))
 
         client_id = self.scope['client'][1]
         print(f"RTSP Consumer connect initiated for stream {client_id}")
@@ -55,8 +154,7 @@ class RTSPConsumer(AsyncWebsocketConsumer):
         logger.info(f'Client connected to stream {self.stream_id}')
         
         try:
-            stream = await sync_to_async(Stream.objects.get)(id=self.stream_id, is_active=True)
-            url = stream.url
+            client, started = await acquire_stream(self.stream_id, self.mode)
         except Stream.DoesNotExist:
             await self.send(text_data=json.dumps({
                 'type': 'error',
@@ -64,31 +162,29 @@ class RTSPConsumer(AsyncWebsocketConsumer):
             }))
             await self.close()
             return
-        
-        if self.stream_id in active_streams:
-            client = active_streams[self.stream_id]
-            client.add_client()
+        except StreamUnreachable as e:
             await self.send(text_data=json.dumps({
-                'type': 'status',
-                'message': 'Joined existing stream'
+                'type': 'error',
+                'message': f'Stream unreachable: {e}'
             }))
-        else:
-            client = RTSPClient(self.stream_id, url, self.group_name)
-            active_streams[self.stream_id] = client
-            client.start()
+            await self.close()
+            return
+        self.joined = True
+
+        if started:
             await self.send(text_data=json.dumps({
                     'type': 'status',
                     'message': 'Started new stream'
                 }))
-            
-        # Make sure cleanup task is running
-        for task in asyncio.all_tasks():
-            if task.get_name() == 'cleanup_streams':
-                break
         else:
-            # Start cleanup task if not already running
-            cleanup_task = asyncio.create_task(cleanup_streams())
-            cleanup_task.set_name('cleanup_streams')
+            await self.send(text_data=json.dumps({
+                'type': 'status',
+                'message': 'Joined existing stream'
+            }))
+            # Unchanged frames are not resent, so give the new viewer the latest one right away
+            message = buffered_frame_message(client)
+            if message:
+                await self.send(bytes_data=message)
 
     async def disconnect(self, close_code):
         """Handle client disconnection"""
@@ -101,14 +197,8 @@ class RTSPConsumer(AsyncWebsocketConsumer):
         )
         
         # Remove client from stream
-        def remove_client():
-            if self.stream_id in active_streams:
-                client = active_streams[self.stream_id]
-            client.remove_client()
-            if client.client_count == 0:
-                del active_streams[self.stream_id]
-                
-        await sync_to_async(remove_client)()
+        if self.joined:
+            await release_stream(self.pipeline_key)
         logger.info(f'Client disconnected from stream {self.stream_id}')
     
     async def receive(self, text_data):
@@ -122,29 +212,42 @@ class RTSPConsumer(AsyncWebsocketConsumer):
                 await self.send(text_data=json.dumps({
                     'type': 'pong'
                 }))
-            
-        except json.JSONDecodeError:
+            elif message_type == 'set_max_fps':
+                self.limiter.set_max_fps(parse_max_fps(text_data_json.get('max_fps')))
+
+        except (json.JSONDecodeError, AttributeError):
             pass
     
     async def stream_frame(self, event):
-        """Send a video frame to the client"""
+        """Send a video frame to the client, prefixed with its latency trace header"""
+        # Decimate to the viewer's max fps before doing any work for this frame
+        if not self.limiter.allow():
+            return
         try:
-            # await self.send(text_data=json.dumps({
-            #     'type': 'stream_frame',
-            #     'frame': event['frame'],
-            #     'stream_id': event['stream_id']
-            # }))
-            await self.send(bytes_data=event['frame'])
+            trace = FrameTrace(event.get('seq', 0), event.get('trace'))
+            trace.mark('sent')
+            await self.send(bytes_data=trace.pack_header() + event['frame'])
+            log_sampled(self.stream_id, trace)
         except Exception as e:
             logger.error(f"Error sending frame to client: {str(e)}")
     
+    async def stream_heartbeat(self, event):
+        """Keep the client alive while unchanged frames are being skipped"""
+        try:
+            await self.send(text_data=json.dumps({
+                'type': 'stream_heartbeat',
+                'stream_id': stream_id_of(event['stream_id'])
+            }))
+        except Exception as e:
+            logger.error(f"Error sending heartbeat to client: {str(e)}")
+
     async def stream_status(self, event):
         """Send status message to client"""
         try:
             await self.send(text_data=json.dumps({
                 'type': 'stream_status',
                 'message': event['message'],
-                'stream_id': event['stream_id']
+                'stream_id': stream_id_of(event['stream_id'])
             }))
         except Exception as e:
             logger.error(f"Error sending status to client: {str(e)}")
@@ -155,8 +258,197 @@ class RTSPConsumer(AsyncWebsocketConsumer):
             await self.send(text_data=json.dumps({
                 'type': 'stream_error',
                 'message': event['message'],
-                'stream_id': event['stream_id']
+                'stream_id': stream_id_of(event['stream_id'])
             }))
         except Exception as e:
             logger.error(f"Error sending error to client: {str(e)}")
         
+
+
+# Multiplexed connections
+MAX_SUBSCRIPTIONS = 64
+# Frames older than this (since they were enqueued) are dropped instead of sent
+MAX_FRAME_LAG = 1.0
+# If frames keep arriving late for this long, the heaviest subscription is dropped
+PRESSURE_DROP_AFTER = 5.0
+
+_TAG = struct.Struct('>H')
+
+class Subscription:
+    def __init__(self, stream_id, tag, max_fps=None):
+        self.stream_id = stream_id
+        self.tag = tag
+        self.limiter = FrameRateLimiter(max_fps)
+        self.subscribed_at = time.monotonic()
+        self.bytes_sent = 0
+        self.frames_sent = 0
+        self.frames_dropped = 0
+
+    def send_rate(self):
+        """Average bytes/sec since subscribing"""
+        return self.bytes_sent / max(time.monotonic() - self.subscribed_at, 1.0)
+
+class MultiplexConsumer(AsyncWebsocketConsumer):
+    """
+    Many streams over one WebSocket.
+
+    Control messages (JSON text):
+        {"type": "subscribe", "stream_id": "1", "max_fps": 5}  ->  {"type": "subscribed", "stream_id": "1", "tag": 3}
+        {"type": "unsubscribe", "stream_id": "1"}               ->  {"type": "unsubscribed", "stream_id": "1"}
+        {"type": "set_max_fps", "stream_id": "1", "max_fps": 2}
+        {"type": "ping"}                                        ->  {"type": "pong"}
+
+    Connecting with ?mode=preview subscribes to keyframe-only thumbnail pipelines.
+
+    Frames (binary): tag u16 big-endian | trace header (see frame_trace) | JPEG.
+    A subscription whose frames can't be delivered in time is dropped with
+    {"type": "dropped", "stream_id": "1", "reason": "backpressure"}.
+    """
+
+    async def connect(self):
+        self.subscriptions: dict[str, Subscription] = {}
+        query = parse_qs(self.scope.get('query_string', b'').decode(errors='ignore'))
+        self.mode = parse_mode(query.get('mode', [None])[0])
+        self.next_tag = 1
+        self.pressure_since = None
+        await self.accept()
+        logger.info('Multiplexed client connected')
+
+    async def disconnect(self, close_code):
+        for stream_id in list(self.subscriptions):
+            await self._unsubscribe(stream_id)
+        logger.info('Multiplexed client disconnected')
+
+    async def _send_json(self, message):
+        await self.send(text_data=json.dumps(message))
+
+    def _allocate_tag(self):
+        used = {subscription.tag for subscription in self.subscriptions.values()}
+        while self.next_tag in used:
+            self.next_tag = self.next_tag % 0xFFFF + 1
+        tag = self.next_tag
+        self.next_tag = self.next_tag % 0xFFFF + 1
+        return tag
+
+    async def _subscribe(self, stream_id, max_fps):
+        if stream_id in self.subscriptions:
+            self.subscriptions[stream_id].limiter.set_max_fps(max_fps)
+            await self._send_json({'type': 'subscribed', 'stream_id': stream_id, 'tag': self.subscriptions[stream_id].tag})
+            return
+        if len(self.subscriptions) >= MAX_SUBSCRIPTIONS:
+            await self._send_json({'type': 'error', 'stream_id': stream_id, 'message': 'Too many subscriptions'})
+            return
+
+        try:
+            client, _ = await acquire_stream(stream_id, self.mode)
+        except Stream.DoesNotExist:
+            await self._send_json({'type': 'error', 'stream_id': stream_id, 'message': 'Stream not found'})
+            return
+        except StreamUnreachable as e:
+            await self._send_json({'type': 'error', 'stream_id': stream_id, 'message': f'Stream unreachable: {e}'})
+            return
+
+        subscription = Subscription(stream_id, self._allocate_tag(), max_fps)
+        self.subscriptions[stream_id] = subscription
+        await self.channel_layer.group_add(stream_group_name(pipeline_key(stream_id, self.mode)), self.channel_name)
+        await self._send_json({'type': 'subscribed', 'stream_id': stream_id, 'tag': subscription.tag})
+        logger.info(f'Multiplexed client subscribed to stream {stream_id} (tag {subscription.tag})')
+
+        message = buffered_frame_message(client)
+        if message:
+            await self.send(bytes_data=_TAG.pack(subscription.tag) + message)
+
+    async def _unsubscribe(self, stream_id):
+        if self.subscriptions.pop(stream_id, None) is None:
+            return False
+        key = pipeline_key(stream_id, self.mode)
+        await self.channel_layer.group_discard(stream_group_name(key), self.channel_name)
+        await release_stream(key)
+        logger.info(f'Multiplexed client unsubscribed from stream {stream_id}')
+        return True
+
+    async def receive(self, text_data=None, bytes_data=None):
+        """Handle subscription control messages"""
+        try:
+            message = json.loads(text_data or '')
+        except json.JSONDecodeError:
+            return
+        if not isinstance(message, dict):
+            return
+
+        message_type = message.get('type')
+        stream_id = str(message.get('stream_id', ''))
+
+        if message_type == 'ping':
+            await self._send_json({'type': 'pong'})
+        elif not (stream_id.isascii() and stream_id.isdigit()):
+            # Stream ids are integers, anything else would fail the lookup in acquire_stream
+            await self._send_json({'type': 'error', 'message': 'Missing or invalid stream_id'})
+        elif message_type == 'subscribe':
+            await self._subscribe(stream_id, parse_max_fps(message.get('max_fps')))
+        elif message_type == 'unsubscribe':
+            if await self._unsubscribe(stream_id):
+                await self._send_json({'type': 'unsubscribed', 'stream_id': stream_id})
+        elif message_type == 'set_max_fps' and stream_id in self.subscriptions:
+            self.subscriptions[stream_id].limiter.set_max_fps(parse_max_fps(message.get('max_fps')))
+
+    async def _relieve_pressure(self, lagging):
+        """Track how long frames have been late, drop the heaviest subscription if it lasts"""
+        now = time.monotonic()
+        if not lagging:
+            self.pressure_since = None
+            return
+        if self.pressure_since is None:
+            self.pressure_since = now
+            return
+        if now - self.pressure_since < PRESSURE_DROP_AFTER or not self.subscriptions:
+            return
+
+        heaviest = max(self.subscriptions.values(), key=lambda subscription: subscription.send_rate())
+        logger.warning(f'Multiplexed client can not keep up, dropping stream {heaviest.stream_id} '
+                       f'({heaviest.send_rate() / 1024:.0f} KiB/s)')
+        await self._unsubscribe(heaviest.stream_id)
+        await self._send_json({'type': 'dropped', 'stream_id': heaviest.stream_id, 'reason': 'backpressure'})
+        # Give the remaining subscriptions a fresh grace period
+        self.pressure_since = now
+
+    async def stream_frame(self, event):
+        """Send a tagged video frame, subject to the subscription's rate limit and lag budget"""
+        subscription = self.subscriptions.get(stream_id_of(event.get('stream_id', '')))
+        if subscription is None:
+            return  # Frame raced an unsubscribe
+
+        trace = FrameTrace(event.get('seq', 0), event.get('trace'))
+        lag = trace.elapsed('enqueue')
+        lagging = lag is not None and lag > MAX_FRAME_LAG
+        await self._relieve_pressure(lagging)
+        if lagging:
+            subscription.frames_dropped += 1
+            return
+        if not subscription.limiter.allow():
+            return
+
+        try:
+            trace.mark('sent')
+            message = _TAG.pack(subscription.tag) + trace.pack_header() + event['frame']
+            await self.send(bytes_data=message)
+            subscription.bytes_sent += len(message)
+            subscription.frames_sent += 1
+            log_sampled(subscription.stream_id, trace)
+        except Exception as e:
+            logger.error(f"Error sending multiplexed frame to client: {str(e)}")
+
+    async def stream_heartbeat(self, event):
+        stream_id = stream_id_of(event['stream_id'])
+        if stream_id in self.subscriptions:
+            await self._send_json({'type': 'stream_heartbeat', 'stream_id': stream_id})
+
+    async def stream_status(self, event):
+        stream_id = stream_id_of(event['stream_id'])
+        if stream_id in self.subscriptions:
+            await self._send_json({'type': 'stream_status', 'message': event['message'], 'stream_id': stream_id})
+
+    async def stream_error(self, event):
+        stream_id = stream_id_of(event['stream_id'])
+        if stream_id in self.subscriptions:
+            await self._send_json({'type': 'stream_error', 'message': event['message'], 'stream_id': stream_id})
@@ -0,0 +1,154 @@
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+from django.core.management.base import BaseCommand, CommandError
+
+VIDEO_EXTENSIONS = {'.mp4', '.mkv', '.avi', '.mov', '.ts', '.m4v', '.webm'}
+
+# Set per worker process by _init_worker
+_detector = None
+
+
+def _init_worker(detection_width, min_face_size):
+    global _detector
+    from stream.utils.mtcnn_detector import MTCNNDetector
+    # One process per core already, OpenCV's own thread pool would only oversubscribe
+    cv2.setNumThreads(1)
+    _detector = MTCNNDetector(detection_width=detection_width, min_face_size=min_face_size)
+
+
+def _analyze_segment(path, start_frame, end_frame, step):
+    """Decode frames [start_frame, end_frame) of a file and detect faces on every step-th one"""
+    started_cpu = time.process_time()
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        return path, [], 0, 0, time.process_time() - started_cpu
+    fps = capture.get(cv2.CAP_PROP_FPS) or 0
+    if start_frame:
+        capture.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+
+    records = []
+    decoded = analyzed = 0
+    for index in range(start_frame, end_frame):
+        # grab() only demuxes and decodes, skipped frames are never converted
+        if not capture.grab():
+            break
+        decoded += 1
+        if (index - start_frame) % step:
+            continue
+        ok, frame = capture.retrieve()
+        if not ok:
+            continue
+        analyzed += 1
+        faces = _detector.find_faces(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+        if faces:
+            records.append({
+                'file': path,
+                'frame': index,
+                'timestamp': round(index / fps, 3) if fps else None,
+                'faces': [
+                    {'box': [int(x), int(y), int(w), int(h)], 'confidence': round(float(confidence), 4)}
+                    for x, y, w, h, confidence in faces
+                ],
+            })
+    capture.release()
+    return path, records, decoded, analyzed, time.process_time() - started_cpu
+
+
+class Command(BaseCommand):
+    help = "Run face detection over recorded video files in parallel and write detections as JSONL"
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help="Video files or directories containing them")
+        parser.add_argument('--output', '-o', default='-', help="JSONL output file, '-' for stdout")
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Worker processes")
+        parser.add_argument('--fps', type=float, default=None,
+                            help="Analyze at most this many frames per second of video (default: every frame)")
+        parser.add_argument('--segment-seconds', type=float, default=30.0,
+                            help="Split files into segments of this length so one long file uses every core")
+        parser.add_argument('--detection-width', type=int, default=None)
+        parser.add_argument('--min-face-size', type=int, default=20)
+
+    def _collect_files(self, paths):
+        files = []
+        for path in paths:
+            if os.path.isdir(path):
+                for root, _, names in os.walk(path):
+                    files.extend(
+                        os.path.join(root, name) for name in sorted(names)
+                        if os.path.splitext(name)[1].lower() in VIDEO_EXTENSIONS
+                    )
+            elif os.path.isfile(path):
+                files.append(path)
+            else:
+                raise CommandError(f"No such file or directory: {path}")
+        return files
+
+    def _segments(self, files, fps_limit, segment_seconds):
+        """(path, start_frame, end_frame, step) tasks plus the total video duration in seconds"""
+        tasks, duration = [], 0.0
+        for path in files:
+            capture = cv2.VideoCapture(path)
+            if not capture.isOpened():
+                self.stderr.write(f"Skipping {path}: could not open")
+                continue
+            frame_count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+            fps = capture.get(cv2.CAP_PROP_FPS) or 25.0
+            capture.release()
+            if frame_count <= 0:
+                self.stderr.write(f"Skipping {path}: unknown frame count")
+                continue
+            duration += frame_count / fps
+            step = max(1, round(fps / fps_limit)) if fps_limit else 1
+            # Segments start on a multiple of step so sampling stays uniform across boundaries
+            segment_frames = max(step, int(segment_seconds * fps) // step * step)
+            for start in range(0, frame_count, segment_frames):
+                tasks.append((path, start, min(frame_count, start + segment_frames), step))
+        return tasks, duration
+
+    def handle(self, *args, **options):
+        files = self._collect_files(options['paths'])
+        if not files:
+            raise CommandError("No video files found")
+        tasks, duration = self._segments(files, options['fps'], options['segment_seconds'])
+        if not tasks:
+            raise CommandError("None of the video files could be read")
+        workers = max(1, min(options['workers'], len(tasks)))
+        self.stderr.write(f"Analyzing {len(files)} file(s), {duration:.1f} s of video in "
+                          f"{len(tasks)} segment(s) on {workers} worker(s)")
+
+        output = sys.stdout if options['output'] == '-' else open(options['output'], 'w')
+        decoded = analyzed = detections = 0
+        cpu_seconds = 0.0
+        started = time.perf_counter()
+        try:
+            with ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_init_worker,
+                initargs=(options['detection_width'], options['min_face_size']),
+            ) as executor:
+                # map() yields in submission order, so the output stays sorted by file and frame
+                for _, records, segment_decoded, segment_analyzed, segment_cpu in executor.map(
+                    _analyze_segment, *zip(*tasks)
+                ):
+                    for record in records:
+                        output.write(json.dumps(record) + '\n')
+                    decoded += segment_decoded
+                    analyzed += segment_analyzed
+                    detections += sum(len(record['faces']) for record in records)
+                    cpu_seconds += segment_cpu
+        finally:
+            if output is not sys.stdout:
+                output.close()
+        elapsed = time.perf_counter() - started
+
+        # Per core is measured against worker CPU time, so it holds with more workers than cores
+        self.stderr.write(
+            f"Decoded {decoded} frames, analyzed {analyzed}, found {detections} faces in {elapsed:.2f} s: "
+            f"{analyzed / elapsed:.1f} frames/s total, {analyzed / max(cpu_seconds, 1e-9):.1f} frames/s per core, "
+            f"{duration / elapsed:.1f}x real time"
+        )
@@ -0,0 +1,48 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from stream.utils.face_gallery import FaceGallery, normalize
+
+
+class Command(BaseCommand):
+    help = "Measure face gallery lookup latency and recall with random embeddings"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=100_000, help="Number of identities in the gallery")
+        parser.add_argument('--dim', type=int, default=128, help="Embedding dimensions")
+        parser.add_argument('--queries', type=int, default=500, help="Number of single lookups to time")
+        parser.add_argument('--noise', type=float, default=0.3, help="Query distance from its identity (cosine-ish)")
+        parser.add_argument('--k', type=int, default=5)
+
+    def handle(self, *args, **options):
+        size, dim, k = options['size'], options['dim'], options['k']
+        rng = np.random.default_rng(0)
+
+        gallery = FaceGallery(dim, capacity=size)
+        embeddings = normalize(rng.standard_normal((size, dim), dtype=np.float32))
+        for embedding in embeddings:
+            gallery.add(embedding)
+        started = time.perf_counter()
+        gallery.build_index()
+        self.stdout.write(f"Index built in {time.perf_counter() - started:.2f} s")
+
+        # Queries are noisy views of known identities, like a face seen again on another camera
+        targets = rng.choice(size, options['queries'], replace=False)
+        noise = normalize(rng.standard_normal((len(targets), dim), dtype=np.float32)) * options['noise']
+        queries = normalize(embeddings[targets] + noise)
+        gallery.search(queries[0], k)  # Warm up BLAS and the page cache
+
+        timings, hits = [], 0
+        for target, query in zip(targets, queries):
+            started = time.perf_counter()
+            matches = gallery.search(query, k)[0]
+            timings.append((time.perf_counter() - started) * 1000)
+            hits += bool(matches) and matches[0][0] == target
+        timings.sort()
+
+        self.stdout.write(
+            f"{size} x {dim} gallery: lookup p50 {timings[len(timings) // 2]:.3f} ms, "
+            f"p99 {timings[int(len(timings) * 0.99)]:.3f} ms, recall@1 {hits / len(targets):.3f}"
+        )
@@ -0,0 +1,96 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from stream.models import Stream
+from stream.utils.load_shedder import get_load_shedder
+from stream.utils.rtsp_client import RTSPClient, PREVIEW_MODE, process_cpu_seconds
+
+
+class _BenchmarkClient(RTSPClient):
+    """Counts frames instead of publishing them"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.frames_published = 0
+        self.bytes_published = 0
+
+    def _publish(self, event):
+        if event['type'] == 'stream_frame':
+            self.frames_published += 1
+            self.bytes_published += len(event['frame'])
+
+    def _record_connect(self, transport, error=''):
+        pass
+
+
+class Command(BaseCommand):
+    help = "Measure CPU per stream of the full pipeline against the keyframe-only preview mode"
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help="Stream id or RTSP URL, e.g. the demo_rtsp_server")
+        parser.add_argument('--duration', type=float, default=30.0, help="Seconds to measure each mode")
+        parser.add_argument('--warmup', type=float, default=5.0, help="Seconds to run before measuring")
+        parser.add_argument('--modes', nargs='+', default=['full', PREVIEW_MODE], choices=['full', PREVIEW_MODE])
+
+    def _config(self, source, mode):
+        if source.isdigit():
+            try:
+                stream = Stream.objects.get(id=source)
+            except Stream.DoesNotExist:
+                raise CommandError(f"No stream with id {source}")
+            return stream.url, stream.pipeline_config(mode)
+        return source, {'mode': mode}
+
+    def _measure(self, url, config, duration, warmup):
+        client = _BenchmarkClient('benchmark', url, 'benchmark', config)
+        client.start()
+        try:
+            deadline = time.monotonic() + 30
+            while client.state != 'streaming':
+                if not client.is_running or time.monotonic() > deadline:
+                    raise CommandError(f"Could not connect to {url}")
+                time.sleep(0.1)
+            time.sleep(warmup)
+
+            pid = client.process.pid
+            ffmpeg_start, python_start = process_cpu_seconds(pid) or 0.0, time.process_time()
+            frames_start, bytes_start = client.frames_published, client.bytes_published
+            started = time.monotonic()
+            time.sleep(duration)
+            elapsed = time.monotonic() - started
+            # Measured over the whole process, the benchmark runs a single pipeline at a time
+            ffmpeg_cpu = (process_cpu_seconds(pid) or 0.0) - ffmpeg_start
+            python_cpu = time.process_time() - python_start
+            frames = client.frames_published - frames_start
+            frame_bytes = client.bytes_published - bytes_start
+        finally:
+            client.is_running = False
+            client.thread.join(timeout=5.0)
+        return {
+            'ffmpeg': ffmpeg_cpu / elapsed * 100,
+            'python': python_cpu / elapsed * 100,
+            'fps': frames / elapsed,
+            'frame_kib': frame_bytes / frames / 1024 if frames else 0.0,
+        }
+
+    def handle(self, *args, **options):
+        # Shedding would change the pipeline under measurement
+        get_load_shedder().enabled = False
+        results = {}
+        for mode in options['modes']:
+            url, config = self._config(options['source'], mode)
+            self.stderr.write(f"Measuring {mode} mode for {options['duration']:.0f}s...")
+            results[mode] = self._measure(url, config, options['duration'], options['warmup'])
+
+        self.stdout.write(f"{'mode':<8} {'ffmpeg %':>9} {'python %':>9} {'total %':>8} {'fps':>6} {'KiB/frame':>10}")
+        for mode, result in results.items():
+            self.stdout.write(
+                f"{mode:<8} {result['ffmpeg']:>9.1f} {result['python']:>9.1f} "
+                f"{result['ffmpeg'] + result['python']:>8.1f} {result['fps']:>6.2f} {result['frame_kib']:>10.1f}"
+            )
+        if 'full' in results and PREVIEW_MODE in results:
+            full = results['full']['ffmpeg'] + results['full']['python']
+            preview = results[PREVIEW_MODE]['ffmpeg'] + results[PREVIEW_MODE]['python']
+            if preview > 0:
+                self.stdout.write(f"Preview mode uses {full / preview:.1f}x less CPU per stream")
@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from stream.models import Stream
+from stream.utils.stream_prober import get_stream_prober
+
+
+class Command(BaseCommand):
+    help = "Probe streams with ffprobe and cache codec, resolution, fps and transport on each Stream"
+
+    def add_arguments(self, parser):
+        parser.add_argument('ids', nargs='*', type=int, help="Stream ids to probe (default: all active streams)")
+        parser.add_argument('--workers', type=int, default=None, help="Concurrent ffprobe processes")
+        parser.add_argument('--loop', action='store_true', help="Keep probing every STREAM_PROBE_INTERVAL seconds")
+
+    def handle(self, *args, **options):
+        prober = get_stream_prober()
+        if options['workers']:
+            prober.max_workers = options['workers']
+
+        while True:
+            queryset = Stream.objects.filter(id__in=options['ids']) if options['ids'] else Stream.objects.filter(is_active=True)
+            streams = list(queryset)
+            started = time.monotonic()
+            results = prober.probe_all(streams)
+            for stream in streams:
+                fields = results[stream.id]
+                if fields['probe_status'] == Stream.PROBE_OK:
+                    self.stdout.write(
+                        f"{stream.id:>6} {stream.name[:30]:<30} ok  {fields['source_codec']} "
+                        f"{fields['source_width']}x{fields['source_height']} @ {fields['source_fps']} fps "
+                        f"{fields['source_transport'] or '-'}"
+                    )
+                else:
+                    self.stdout.write(f"{stream.id:>6} {stream.name[:30]:<30} {fields['probe_status']}: {fields['probe_error']}")
+            self.stdout.write(f"Probed {len(streams)} streams in {time.monotonic() - started:.1f}s")
+
+            if not options['loop'] or not prober.interval:
+                break
+            time.sleep(prober.interval)
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-19 05:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stream', '0002_alter_stream_url'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stream',
+            name='detection_regions',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='stream',
+            name='detection_width',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='stream',
+            name='min_face_size',
+            field=models.PositiveIntegerField(default=20),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-19 05:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stream', '0003_stream_detection_settings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stream',
+            name='decoder_threads',
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='stream',
+            name='detection_enabled',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddField(
+            model_name='stream',
+            name='fps',
+            field=models.PositiveSmallIntegerField(default=15),
+        ),
+        migrations.AddField(
+            model_name='stream',
+            name='jpeg_quality',
+            field=models.PositiveSmallIntegerField(default=10),
+        ),
+        migrations.AddField(
+            model_name='stream',
+            name='scale_width',
+            field=models.PositiveIntegerField(default=640),
+        ),
+    ]
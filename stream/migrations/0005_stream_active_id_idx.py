@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-19 05:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stream', '0004_stream_pipeline_settings'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='stream',
+            index=models.Index(fields=['is_active', 'id'], name='stream_active_id_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 05:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stream', '0005_stream_active_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stream',
+            name='embeddings_enabled',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 05:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stream', '0006_stream_embeddings_enabled'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stream',
+            name='priority',
+            field=models.SmallIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-19 05:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stream', '0007_stream_priority'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stream',
+            name='probe_error',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='stream',
+            name='probe_status',
+            field=models.CharField(choices=[('unknown', 'Unknown'), ('ok', 'OK'), ('unreachable', 'Unreachable')], default='unknown', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='stream',
+            name='probed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='stream',
+            name='source_codec',
+            field=models.CharField(blank=True, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='stream',
+            name='source_fps',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='stream',
+            name='source_height',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='stream',
+            name='source_transport',
+            field=models.CharField(blank=True, max_length=8),
+        ),
+        migrations.AddField(
+            model_name='stream',
+            name='source_width',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -1,13 +1,95 @@
 from django.db import models
+from django.utils import timezone
 
 # Create your models here.
 
 class Stream(models.Model):
+    PROBE_UNKNOWN = 'unknown'
+    PROBE_OK = 'ok'
+    PROBE_UNREACHABLE = 'unreachable'
+    PROBE_STATUS_CHOICES = [
+        (PROBE_UNKNOWN, 'Unknown'),
+        (PROBE_OK, 'OK'),
+        (PROBE_UNREACHABLE, 'Unreachable'),
+    ]
+
     name = models.CharField(max_length=255)
     url = models.CharField(max_length=255)
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # Pipeline settings, applied live to running streams
+    fps = models.PositiveSmallIntegerField(default=15)
+    scale_width = models.PositiveIntegerField(default=640)
+    jpeg_quality = models.PositiveSmallIntegerField(default=10)  # ffmpeg -q:v, lower is better
+    decoder_threads = models.PositiveSmallIntegerField(null=True, blank=True)  # null = derived from cpu count
+    detection_enabled = models.BooleanField(default=True)
+    embeddings_enabled = models.BooleanField(default=False)  # Match detected faces against the face gallery
+    priority = models.SmallIntegerField(default=0)  # Higher priority streams are shed last under CPU pressure
+
+    # Face detection settings
+    detection_width = models.PositiveIntegerField(null=True, blank=True)  # Downscale frames to this width before detection, null = full frame
+    min_face_size = models.PositiveIntegerField(default=20)  # In full-frame pixels
+    detection_regions = models.JSONField(default=list, blank=True)  # Polygons of [x, y] points normalized to [0, 1]
+
+    # Source metadata cached by the stream prober (see utils/stream_prober.py)
+    source_codec = models.CharField(max_length=32, blank=True)
+    source_width = models.PositiveIntegerField(null=True, blank=True)
+    source_height = models.PositiveIntegerField(null=True, blank=True)
+    source_fps = models.FloatField(null=True, blank=True)
+    source_transport = models.CharField(max_length=8, blank=True)  # Last RTSP transport that worked
+    probe_status = models.CharField(max_length=16, choices=PROBE_STATUS_CHOICES, default=PROBE_UNKNOWN)
+    probe_error = models.CharField(max_length=255, blank=True)
+    probed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Active stream listing, ordered by id for cursor pagination
+            models.Index(fields=['is_active', 'id'], name='stream_active_id_idx'),
+        ]
+
     def __str__(self):
         return self.name
+
+    def detection_config(self):
+        """Keyword arguments for MTCNNDetector"""
+        return {
+            'detection_width': self.detection_width,
+            'min_face_size': self.min_face_size,
+            'regions': self.detection_regions,
+        }
+
+    def pipeline_config(self, mode='full'):
+        """Per-stream overrides for RTSPClient's DEFAULT_PIPELINE_CONFIG, mode 'preview' for keyframe thumbnails"""
+        return {
+            'mode': mode,
+            'fps': self.fps,
+            'scale_width': self.scale_width,
+            'jpeg_quality': self.jpeg_quality,
+            'decoder_threads': self.decoder_threads,
+            'detection_enabled': self.detection_enabled,
+            'detection': self.detection_config(),
+            'embeddings_enabled': self.embeddings_enabled,
+            'priority': self.priority,
+            'source': self.source_config(),
+        }
+
+    def source_config(self):
+        """Cached source metadata, empty until the stream has been probed"""
+        if self.probe_status != self.PROBE_OK:
+            return {}
+        return {
+            'codec': self.source_codec,
+            'width': self.source_width,
+            'height': self.source_height,
+            'fps': self.source_fps,
+            'transport': self.source_transport,
+        }
+
+    def recently_unreachable(self, retry_after):
+        """True if the last probe or connect attempt failed less than retry_after seconds ago"""
+        return (
+            self.probe_status == self.PROBE_UNREACHABLE and self.probed_at is not None
+            and (timezone.now() - self.probed_at).total_seconds() < retry_after
+        )
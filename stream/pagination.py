@@ -0,0 +1,9 @@
+from rest_framework.pagination import CursorPagination
+
+
+class StreamCursorPagination(CursorPagination):
+    """Stable paging over large camera lists, backed by the (is_active, id) index"""
+    ordering = '-id'
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 500
@@ -4,5 +4,120 @@ from .models import Stream
 class StreamSerializer(serializers.ModelSerializer):
     class Meta:
         model = Stream
-        fields = ['id', 'name', 'url', 'is_active', 'created_at', 'updated_at']
-        read_only_fields = ['created_at', 'updated_at'] 
\ No newline at end of file
+        fields = [
+            'id', 'name', 'url', 'is_active', 'created_at', 'updated_at',
+            'fps', 'scale_width', 'jpeg_quality', 'decoder_threads', 'detection_enabled', 'embeddings_enabled',
+            'priority',
+            'source_codec', 'source_width', 'source_height', 'source_fps', 'source_transport',
+            'probe_status', 'probe_error', 'probed_at',
+            'detection_width', 'min_face_size', 'detection_regions',
+        ]
+        read_only_fields = [
+            'created_at', 'updated_at',
+            'source_codec', 'source_width', 'source_height', 'source_fps', 'source_transport',
+            'probe_status', 'probe_error', 'probed_at',
+        ]
+
+    def validate_fps(self, value):
+        if not 1 <= value <= 60:
+            raise serializers.ValidationError("FPS must be between 1 and 60.")
+        return value
+
+    def validate_scale_width(self, value):
+        if not 64 <= value <= 3840:
+            raise serializers.ValidationError("Scale width must be between 64 and 3840 pixels.")
+        return value
+
+    def validate_jpeg_quality(self, value):
+        if not 2 <= value <= 31:
+            raise serializers.ValidationError("JPEG quality must be between 2 (best) and 31 (worst).")
+        return value
+
+    def validate_decoder_threads(self, value):
+        if value is not None and not 1 <= value <= 16:
+            raise serializers.ValidationError("Decoder threads must be between 1 and 16.")
+        return value
+
+    def validate_priority(self, value):
+        if not -100 <= value <= 100:
+            raise serializers.ValidationError("Priority must be between -100 and 100.")
+        return value
+
+    def validate_detection_width(self, value):
+        if value is not None and value < 64:
+            raise serializers.ValidationError("Detection width must be at least 64 pixels.")
+        return value
+
+    def validate_detection_regions(self, value):
+        if not isinstance(value, list):
+            raise serializers.ValidationError("Expected a list of polygons.")
+        for polygon in value:
+            if not isinstance(polygon, list) or len(polygon) < 3:
+                raise serializers.ValidationError("Each region must be a polygon with at least 3 points.")
+            for point in polygon:
+                if (not isinstance(point, list) or len(point) != 2
+                        or not all(isinstance(c, (int, float)) and 0 <= c <= 1 for c in point)):
+                    raise serializers.ValidationError("Region points must be [x, y] pairs normalized to [0, 1].")
+        return value
+
+
+class StreamIdsSerializer(serializers.Serializer):
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=1000,
+    )
+
+
+class StreamRuntimeStatusSerializer(serializers.Serializer):
+    stream_id = serializers.CharField()
+    state = serializers.CharField()
+    viewers = serializers.IntegerField()
+    transport = serializers.CharField(allow_null=True)
+    input_fps = serializers.FloatField()
+    output_fps = serializers.FloatField()
+    configured_fps = serializers.IntegerField()
+    frames_read = serializers.IntegerField()
+    frames_suppressed = serializers.IntegerField()
+    frames_skipped_stale = serializers.IntegerField()
+    cpu_percent = serializers.FloatField()
+    idle_seconds = serializers.FloatField(allow_null=True)
+    idle_cpu_seconds = serializers.FloatField()
+    detection_enabled = serializers.BooleanField()
+    started_at = serializers.FloatField(allow_null=True)
+    mode = serializers.CharField()
+    priority = serializers.IntegerField()
+    shed_level = serializers.IntegerField()
+    frames_shed = serializers.IntegerField()
+
+
+class FaceSearchSerializer(serializers.Serializer):
+    embedding = serializers.ListField(child=serializers.FloatField(), required=False, min_length=1)
+    image = serializers.ImageField(required=False)
+    k = serializers.IntegerField(min_value=1, max_value=100, default=5)
+
+    def validate(self, attrs):
+        if ('embedding' in attrs) == ('image' in attrs):
+            raise serializers.ValidationError("Provide exactly one of 'embedding' or 'image'.")
+        return attrs
+
+
+class FaceIdentitySerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    label = serializers.CharField(allow_null=True)
+    created_at = serializers.FloatField()
+    sightings = serializers.DictField(child=serializers.FloatField())
+
+
+class FaceGallerySummarySerializer(serializers.Serializer):
+    count = serializers.IntegerField()
+    dim = serializers.IntegerField()
+
+
+class FaceMatchSerializer(FaceIdentitySerializer):
+    similarity = serializers.FloatField()
+
+
+class FaceSearchResultSerializer(serializers.Serializer):
+    results = FaceMatchSerializer(many=True)
+    took_ms = serializers.FloatField()
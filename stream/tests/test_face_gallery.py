@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+from stream.utils import face_gallery
+from stream.utils.face_gallery import FaceGallery, normalize
+
+DIM = 64
+
+
+@pytest.fixture(scope='module')
+def indexed_gallery():
+    """25k random identities with an index over the first 20k, the rest added after it was built"""
+    rng = np.random.default_rng(42)
+    embeddings = normalize(rng.standard_normal((25_000, DIM)))
+    gallery = FaceGallery(DIM)
+    gallery._maybe_build_index = lambda: None  # Built explicitly below, not in a background thread
+    for embedding in embeddings[:20_000]:
+        gallery.add(embedding)
+    gallery.build_index()
+    for embedding in embeddings[20_000:]:
+        gallery.add(embedding)
+    return gallery, embeddings
+
+
+def test_index_covers_rows_it_was_built_over(indexed_gallery):
+    gallery, _ = indexed_gallery
+    centroids, matrix, order, offsets, covered = gallery._index
+    assert covered == 20_000
+    assert offsets[0] == 0 and offsets[-1] == covered
+    assert sorted(order) == list(range(covered))
+    # The list-ordered matrix maps back to the original rows through order
+    np.testing.assert_array_equal(matrix, gallery._matrix[order])
+
+
+def test_exact_matches_are_found_with_their_ids(indexed_gallery):
+    gallery, embeddings = indexed_gallery
+    rng = np.random.default_rng(7)
+    # Rows inside the index and rows added after it, which are scanned exhaustively
+    rows = np.concatenate([rng.choice(20_000, 200, replace=False), rng.choice(np.arange(20_000, 25_000), 200, replace=False)])
+    results = gallery.search(embeddings[rows], k=5)
+    for row, matches in zip(rows, results):
+        row_id, similarity = matches[0]
+        assert row_id == row
+        assert similarity == pytest.approx(1.0, abs=1e-4)
+        assert [score for _, score in matches] == sorted((score for _, score in matches), reverse=True)
+
+
+def test_index_search_matches_a_full_scan_for_added_rows(indexed_gallery):
+    gallery, embeddings = indexed_gallery
+    query = embeddings[24_999] + 0.05 * np.random.default_rng(3).standard_normal(DIM)
+    expected = np.argmax(embeddings[20_000:] @ normalize(query)) + 20_000
+    assert expected in [row_id for row_id, _ in gallery.search(query, k=5)[0]]
+
+
+def test_search_with_only_empty_lists_probed(monkeypatch):
+    gallery = FaceGallery(2)
+    gallery.add([1.0, 0.0])
+    # Two lists, the only row sits in the one pointing away from the query
+    centroids = np.array([[1.0, 0.0], [-1.0, 0.0]], dtype=np.float32)
+    gallery._index = (centroids, gallery._matrix[:1].copy(), np.array([0]), np.array([0, 1, 1]), 1)
+    monkeypatch.setattr(face_gallery, 'IVF_PROBES', 1)
+    assert gallery.search([-1.0, 0.0]) == [[]]
@@ -0,0 +1,56 @@
+import cv2
+import numpy as np
+import logging
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class FaceEmbedder:
+    """
+        Computes face embeddings for detected face crops on CPU with an OpenCV DNN
+        model, by default sized for OpenFace nn4.small2.v1 (96x96 RGB in, 128-d out).
+        Like MTCNNDetector, each pipeline gets its own instance since cv2.dnn nets
+        aren't safe to share between threads.
+    """
+
+    def __init__(self, model_path, input_size=(96, 96), scale=1 / 255.0):
+        self.input_size = tuple(input_size)
+        self.scale = scale
+        self.net = cv2.dnn.readNet(model_path)
+        self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+        self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+        logger.info(f"Face embedding model loaded from {model_path}")
+
+    @classmethod
+    def from_settings(cls):
+        """An embedder for FACE_EMBEDDING_MODEL, None if no model is configured or it fails to load"""
+        model_path = getattr(settings, 'FACE_EMBEDDING_MODEL', None)
+        if not model_path:
+            return None
+        try:
+            return cls(model_path, getattr(settings, 'FACE_EMBEDDING_INPUT_SIZE', (96, 96)))
+        except cv2.error as e:
+            logger.error(f"Failed to load face embedding model {model_path}: {e}")
+            return None
+
+    def embed(self, image_array_rgb, faces):
+        """Embeddings (n, dim) float32 for (x, y, w, h, confidence) faces of an RGB frame"""
+        height, width = image_array_rgb.shape[:2]
+        crops = []
+        for x, y, w, h, _ in faces:
+            x0, y0 = max(0, x), max(0, y)
+            x1, y1 = min(width, x + w), min(height, y + h)
+            if x1 - x0 < 8 or y1 - y0 < 8:
+                continue
+            crops.append(image_array_rgb[y0:y1, x0:x1])
+        if not crops:
+            return np.empty((0, 0), dtype=np.float32)
+
+        # One forward pass for all faces in the frame
+        blob = cv2.dnn.blobFromImages(crops, self.scale, self.input_size, swapRB=False, crop=False)
+        self.net.setInput(blob)
+        embeddings = self.net.forward().reshape(len(crops), -1).astype(np.float32)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings / np.maximum(norms, 1e-12)
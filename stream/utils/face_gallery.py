@@ -0,0 +1,262 @@
+import atexit
+import json
+import os
+import threading
+import time
+import logging
+
+import numpy as np
+from django.conf import settings
+
+logger = logging.getLogger('face_gallery')
+
+# Cosine similarity above which a face is considered an already known identity
+MATCH_THRESHOLD = 0.75
+# Save at most this often while new identities are being added (seconds)
+SAVE_INTERVAL = 60.0
+
+# Above this many identities a full scan no longer fits the lookup budget, so an
+# inverted file index (k-means lists, only the closest IVF_PROBES lists are scanned)
+# is built in the background and rebuilt whenever the gallery grows by IVF_REBUILD_GROWTH
+IVF_MIN_SIZE = 20_000
+IVF_PROBES = 16
+IVF_REBUILD_GROWTH = 1.5
+IVF_TRAIN_SAMPLE = 20_000
+IVF_KMEANS_ITERATIONS = 8
+
+
+def normalize(embeddings):
+    """L2-normalize rows so a dot product is the cosine similarity"""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+    return embeddings / np.maximum(norms, 1e-12)
+
+
+class FaceGallery:
+    """
+        Known face identities as one contiguous float32 matrix of L2-normalized
+        embeddings, so a lookup is a single matrix-vector product.
+
+        Large galleries are searched through an inverted file index, rows added
+        since the index was built are always scanned exhaustively.
+
+        Persisted as <path>/embeddings.npy plus <path>/identities.json. Loading
+        memory-maps the matrix, it is only copied into RAM once something is added.
+    """
+
+    def __init__(self, dim, path=None, capacity=1024):
+        self.dim = dim
+        self.path = path
+        self._matrix = np.zeros((capacity, dim), dtype=np.float32)
+        self._count = 0
+        self.identities = []  # per row: {'id', 'label', 'created_at', 'sightings': {stream_id: last seen}}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._last_save = time.monotonic()
+        # (centroids, list-ordered matrix, row ids in list order, list offsets, rows covered)
+        self._index = None
+        self._indexing = False
+
+    @classmethod
+    def load(cls, path):
+        matrix = np.load(os.path.join(path, 'embeddings.npy'), mmap_mode='r')
+        with open(os.path.join(path, 'identities.json')) as identities_file:
+            identities = json.load(identities_file)
+        gallery = cls(matrix.shape[1], path, capacity=0)
+        gallery._matrix = matrix
+        gallery._count = matrix.shape[0]
+        gallery.identities = identities
+        gallery._maybe_build_index()
+        logger.info(f"Loaded face gallery with {gallery._count} identities from {path}")
+        return gallery
+
+    def __len__(self):
+        return self._count
+
+    def _grow(self):
+        # Also turns a read-only memory map into a writable in-memory matrix
+        capacity = max(1024, self._matrix.shape[0] * 2)
+        matrix = np.zeros((capacity, self.dim), dtype=np.float32)
+        matrix[:self._count] = self._matrix[:self._count]
+        self._matrix = matrix
+
+    def add(self, embedding, label=None, stream_id=None):
+        """Add a new identity, returns its id"""
+        embedding = normalize(embedding)
+        with self._lock:
+            if self._count == self._matrix.shape[0] or not self._matrix.flags.writeable:
+                self._grow()
+            index = self._count
+            self._matrix[index] = embedding
+            self._count += 1
+            now = time.time()
+            self.identities.append({
+                'id': index,
+                'label': label,
+                'created_at': now,
+                'sightings': {str(stream_id): now} if stream_id is not None else {},
+            })
+            self._dirty = True
+        self._maybe_build_index()
+        return index
+
+    def _maybe_build_index(self):
+        with self._lock:
+            covered = self._index[4] if self._index else 0
+            if self._indexing or self._count < IVF_MIN_SIZE or self._count < covered * IVF_REBUILD_GROWTH:
+                return
+            self._indexing = True
+        threading.Thread(target=self.build_index, daemon=True).start()
+
+    def build_index(self):
+        """(Re)build the inverted file index over the current rows, normally done in the background"""
+        self._indexing = True
+        try:
+            with self._lock:
+                count = self._count
+                matrix = np.array(self._matrix[:count])
+            rng = np.random.default_rng(0)
+            list_count = max(16, int(np.sqrt(count)))
+
+            # Spherical k-means on a sample, embeddings are unit length
+            sample = matrix[rng.choice(count, min(count, IVF_TRAIN_SAMPLE), replace=False)]
+            centroids = sample[rng.choice(len(sample), list_count, replace=False)].copy()
+            for _ in range(IVF_KMEANS_ITERATIONS):
+                assignment = np.argmax(sample @ centroids.T, axis=1)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, assignment, sample)
+                empty = np.bincount(assignment, minlength=list_count) == 0
+                sums[empty] = centroids[empty]
+                centroids = normalize(sums)
+
+            assignment = np.concatenate([
+                np.argmax(matrix[start:start + 8192] @ centroids.T, axis=1)
+                for start in range(0, count, 8192)
+            ])
+            order = np.argsort(assignment, kind='stable')
+            offsets = np.searchsorted(assignment[order], np.arange(list_count + 1))
+            index = (centroids, np.ascontiguousarray(matrix[order]), order, offsets, count)
+            with self._lock:
+                self._index = index
+            logger.info(f"Built face gallery index over {count} identities in {list_count} lists")
+        except Exception as e:
+            logger.error(f"Failed to build face gallery index: {e}", exc_info=True)
+        finally:
+            self._indexing = False
+
+    def _search_index(self, query, index):
+        """Candidate (ids, scores) from the closest lists of the index"""
+        centroids, matrix, order, offsets, _ = index
+        probes = min(IVF_PROBES, len(centroids))
+        # Starts non-empty so concatenating works even when every probed list is empty
+        ids, scores = [np.empty(0, dtype=order.dtype)], [np.empty(0, dtype=np.float32)]
+        for list_id in np.argpartition(centroids @ query, -probes)[-probes:]:
+            start, end = offsets[list_id], offsets[list_id + 1]
+            if end > start:
+                ids.append(order[start:end])
+                scores.append(matrix[start:end] @ query)
+        return ids, scores
+
+    def search(self, embeddings, k=5):
+        """
+            Nearest identities for one embedding (dim,) or a batch (n, dim).
+            Returns a list of [(id, similarity), ...] per query, best first.
+        """
+        queries = normalize(embeddings).reshape(-1, self.dim)
+        with self._lock:
+            # Rows below count never change and a grown matrix is a new array,
+            # so the scan itself can run without the lock
+            matrix, count, index = self._matrix, self._count, self._index
+        if count == 0:
+            return [[] for _ in queries]
+
+        if index is None:
+            # One GEMM over the contiguous matrix for the whole batch
+            candidates = [(None, column) for column in (matrix[:count] @ queries.T).T]
+        else:
+            covered = index[4]
+            candidates = []
+            for query in queries:
+                ids, scores = self._search_index(query, index)
+                if count > covered:
+                    ids.append(np.arange(covered, count))
+                    scores.append(matrix[covered:count] @ query)
+                candidates.append((np.concatenate(ids), np.concatenate(scores)))
+
+        results = []
+        for ids, scores in candidates:
+            top_k = min(k, len(scores))
+            top = np.argpartition(scores, -top_k)[-top_k:] if top_k < len(scores) else np.arange(len(scores))
+            top = top[np.argsort(scores[top])[::-1]]
+            row_ids = top if ids is None else ids[top]
+            results.append([(int(row_id), float(scores[position])) for row_id, position in zip(row_ids, top)])
+        return results
+
+    def observe(self, stream_id, embeddings):
+        """Record faces seen on a stream: known ones get a sighting, unknown ones become new identities"""
+        if len(embeddings) == 0:
+            return []
+        matches = self.search(embeddings, k=1)
+        ids = []
+        now = time.time()
+        for embedding, match in zip(embeddings, matches):
+            if match and match[0][1] >= MATCH_THRESHOLD:
+                identity_id = match[0][0]
+                with self._lock:
+                    self.identities[identity_id]['sightings'][str(stream_id)] = now
+                    self._dirty = True
+            else:
+                identity_id = self.add(embedding, stream_id=stream_id)
+            ids.append(identity_id)
+        if self.path and time.monotonic() - self._last_save >= SAVE_INTERVAL:
+            threading.Thread(target=self.flush, daemon=True).start()
+        return ids
+
+    def identity(self, identity_id):
+        with self._lock:
+            if not 0 <= identity_id < self._count:
+                return None
+            return dict(self.identities[identity_id])
+
+    def flush(self):
+        """Save if anything changed since the last save"""
+        if self._dirty:
+            self.save()
+
+    def save(self, path=None):
+        path = path or self.path
+        if not path:
+            return
+        with self._lock:
+            matrix = np.array(self._matrix[:self._count])
+            identities = json.dumps(self.identities)
+            self._dirty = False
+            self._last_save = time.monotonic()
+        os.makedirs(path, exist_ok=True)
+        # Write to temporary files first so a crash never leaves a half-written gallery
+        np.save(os.path.join(path, 'embeddings.tmp.npy'), matrix)
+        with open(os.path.join(path, 'identities.tmp.json'), 'w') as identities_file:
+            identities_file.write(identities)
+        os.replace(os.path.join(path, 'embeddings.tmp.npy'), os.path.join(path, 'embeddings.npy'))
+        os.replace(os.path.join(path, 'identities.tmp.json'), os.path.join(path, 'identities.json'))
+        logger.info(f"Saved face gallery with {len(matrix)} identities to {path}")
+
+
+_gallery = None
+_gallery_lock = threading.Lock()
+
+
+def get_face_gallery():
+    """The process-wide gallery, loaded from FACE_GALLERY_PATH if it has been saved before"""
+    global _gallery
+    with _gallery_lock:
+        if _gallery is None:
+            path = getattr(settings, 'FACE_GALLERY_PATH', None)
+            dim = getattr(settings, 'FACE_EMBEDDING_DIM', 128)
+            if path and os.path.exists(os.path.join(path, 'embeddings.npy')):
+                _gallery = FaceGallery.load(path)
+            else:
+                _gallery = FaceGallery(dim, path)
+            if path:
+                atexit.register(_gallery.flush)
+    return _gallery
@@ -0,0 +1,69 @@
+import hashlib
+import io
+import time
+import logging
+
+import numpy as np
+import PIL
+import PIL.Image as Image
+
+logger = logging.getLogger(__name__)
+
+
+class FrameChangeDetector:
+    """
+        Decides whether a JPEG frame differs enough from the last frame that was
+        sent to be worth sending. Pixel-identical frames are caught by a hash,
+        near-identical ones by comparing small grayscale thumbnails.
+    """
+
+    def __init__(self, threshold=2.0, refresh_interval=10.0, thumbnail_size=(32, 24)):
+        """
+            threshold: mean absolute difference (0-255) of the thumbnails below which
+                       a frame counts as unchanged, 0 disables suppression
+            refresh_interval: seconds after which a frame is sent even if unchanged
+        """
+        self.threshold = threshold
+        self.refresh_interval = refresh_interval
+        self.thumbnail_size = thumbnail_size
+        self._last_digest = None
+        self._last_thumbnail = None
+        self._last_sent_time = 0
+
+    def _thumbnail(self, frame_bytes):
+        try:
+            image = Image.open(io.BytesIO(frame_bytes))
+            # Let the JPEG decoder do the downscaling (DCT scaling), far cheaper than a full decode
+            image.draft('L', (self.thumbnail_size[0] * 2, self.thumbnail_size[1] * 2))
+            image = image.convert('L').resize(self.thumbnail_size, Image.BILINEAR)
+        except (PIL.UnidentifiedImageError, OSError) as e:
+            logger.warning(f"Could not decode frame for change detection: {e}")
+            return None
+        return np.asarray(image, dtype=np.int16)
+
+    def reset(self):
+        """Forget the reference frame so the next frame is always sent"""
+        self._last_digest = None
+        self._last_thumbnail = None
+        self._last_sent_time = 0
+
+    def has_changed(self, frame_bytes):
+        """Return True if the frame should be sent, it then becomes the new reference"""
+        now = time.monotonic()
+        digest = hashlib.blake2b(frame_bytes, digest_size=8).digest()
+
+        if self.threshold > 0 and now - self._last_sent_time < self.refresh_interval:
+            if digest == self._last_digest:
+                return False
+            thumbnail = self._thumbnail(frame_bytes)
+            if (thumbnail is not None and self._last_thumbnail is not None
+                    and thumbnail.shape == self._last_thumbnail.shape
+                    and np.abs(thumbnail - self._last_thumbnail).mean() < self.threshold):
+                return False
+        else:
+            thumbnail = self._thumbnail(frame_bytes) if self.threshold > 0 else None
+
+        self._last_digest = digest
+        self._last_thumbnail = thumbnail
+        self._last_sent_time = now
+        return True
@@ -0,0 +1,121 @@
+import os
+import struct
+import sys
+import threading
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+# Per slot: sequence u64 | length u32 | padding u32 | payload
+_SLOT_HEADER = struct.Struct('<QI4x')
+
+# Ring names start with this, followed by the creating process's pid (see worker_pool)
+RING_PREFIX = 'rtsp_'
+_SHM_DIR = '/dev/shm'
+
+
+def _attach(name):
+    """Open an existing segment without handing its cleanup to this process's resource tracker"""
+    if sys.version_info >= (3, 13):
+        return SharedMemory(name=name, track=False)
+    # A spawned child shares its parent's tracker (the fd is inherited), where the
+    # segment is already registered. Unregistering would drop the creator's entry.
+    # Only a process with a tracker of its own must unregister, or that tracker
+    # unlinks the segment when the process exits.
+    shares_tracker = getattr(resource_tracker._resource_tracker, '_fd', None) is not None
+    shm = SharedMemory(name=name)
+    if not shares_tracker:
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
+
+
+def unlink_stale_rings():
+    """Remove rings left behind by processes that died without cleaning up, returns their names"""
+    if not os.path.isdir(_SHM_DIR):
+        return []
+    removed = []
+    for name in os.listdir(_SHM_DIR):
+        if not name.startswith(RING_PREFIX):
+            continue
+        pid = name[len(RING_PREFIX):].split('_', 1)[0]
+        if not pid.isdigit():
+            continue
+        try:
+            os.kill(int(pid), 0)
+            continue  # Creator is still alive
+        except ProcessLookupError:
+            pass
+        except PermissionError:
+            continue  # Alive, owned by someone else
+        try:
+            os.unlink(os.path.join(_SHM_DIR, name))
+            removed.append(name)
+        except OSError:
+            pass
+    return removed
+
+
+class FrameRing:
+    """
+        Fixed-size ring of frame slots in shared memory, written by a pipeline
+        worker process and read by the ASGI process. Only (slot, seq, length)
+        travels over the IPC queue, the JPEG bytes stay in shared memory.
+
+        Each slot is guarded by a sequence number (seqlock): the writer zeroes it,
+        writes the payload, then publishes the new sequence. A reader that sees a
+        different sequence before or after copying knows the slot was reused and
+        drops the frame instead of sending torn data.
+    """
+
+    def __init__(self, name=None, slot_count=64, slot_size=1 << 20, create=False):
+        self.slot_count = slot_count
+        self.slot_size = slot_size
+        self.stride = _SLOT_HEADER.size + slot_size
+        if create:
+            self.shm = SharedMemory(name=name, create=True, size=self.stride * slot_count)
+        else:
+            # Only the creating process owns the segment
+            self.shm = _attach(name)
+        self.name = self.shm.name
+        self._buf = self.shm.buf
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def write(self, payload):
+        """Copy a frame into the next slot, returns (slot, seq) or None if it doesn't fit"""
+        length = len(payload)
+        if length > self.slot_size:
+            return None
+        with self._lock:
+            self._seq += 1
+            seq = self._seq
+            slot = seq % self.slot_count
+            offset = slot * self.stride
+            _SLOT_HEADER.pack_into(self._buf, offset, 0, 0)
+            start = offset + _SLOT_HEADER.size
+            self._buf[start:start + length] = payload
+            _SLOT_HEADER.pack_into(self._buf, offset, seq, length)
+        return slot, seq
+
+    def read(self, slot, seq):
+        """Copy a frame out of a slot, None if the writer has reused the slot since"""
+        if self._buf is None:
+            return None  # Ring was closed after its worker died
+        offset = slot * self.stride
+        current_seq, length = _SLOT_HEADER.unpack_from(self._buf, offset)
+        if current_seq != seq:
+            return None
+        start = offset + _SLOT_HEADER.size
+        payload = bytes(self._buf[start:start + length])
+        current_seq, _ = _SLOT_HEADER.unpack_from(self._buf, offset)
+        if current_seq != seq:
+            return None
+        return payload
+
+    def close(self, unlink=False):
+        self._buf = None
+        try:
+            self.shm.close()
+            if unlink:
+                self.shm.unlink()
+        except FileNotFoundError:
+            pass
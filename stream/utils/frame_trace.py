@@ -0,0 +1,71 @@
+import struct
+import time
+import logging
+
+logger = logging.getLogger('frame_trace')
+
+# Pipeline stages a frame is timestamped at, in order
+STAGES = ('read', 'split', 'detect', 'encode', 'enqueue', 'sent')
+STAGE_INDEX = {stage: index for index, stage in enumerate(STAGES)}
+
+# Log one in every TRACE_SAMPLE_EVERY frames per viewer
+TRACE_SAMPLE_EVERY = 100
+
+# Binary header prepended to every frame on the WebSocket:
+#   magic "RT" | version u8 | stage count u8 | sequence u32 | stage count x monotonic ns u64
+# A stamp of 0 means the stage was skipped (e.g. detection disabled).
+HEADER_MAGIC = b'RT'
+HEADER_VERSION = 1
+_HEADER = struct.Struct('>2sBBI')
+_STAMPS = struct.Struct(f'>{len(STAGES)}Q')
+HEADER_SIZE = _HEADER.size + _STAMPS.size
+
+
+class FrameTrace:
+    """Sequence number and per-stage monotonic timestamps of one frame"""
+    __slots__ = ('seq', 'stamps')
+
+    def __init__(self, seq, stamps=None):
+        self.seq = seq & 0xFFFFFFFF
+        self.stamps = list(stamps) if stamps else [0] * len(STAGES)
+
+    def mark(self, stage, ns=None):
+        self.stamps[STAGE_INDEX[stage]] = ns if ns is not None else time.monotonic_ns()
+
+    def elapsed(self, stage, now_ns=None):
+        """Seconds since the given stage, None if it was skipped"""
+        stamp = self.stamps[STAGE_INDEX[stage]]
+        if not stamp:
+            return None
+        return ((now_ns or time.monotonic_ns()) - stamp) / 1e9
+
+    def pack_header(self):
+        return _HEADER.pack(HEADER_MAGIC, HEADER_VERSION, len(STAGES), self.seq) + _STAMPS.pack(*self.stamps)
+
+    def breakdown(self):
+        """Milliseconds from 'read' to each stage, None for skipped stages"""
+        origin = self.stamps[0]
+        return {
+            stage: (stamp - origin) / 1e6 if stamp and origin else None
+            for stage, stamp in zip(STAGES, self.stamps)
+        }
+
+
+def unpack_header(data):
+    """Return (FrameTrace, payload offset) for a framed message, or (None, 0) if it has no header"""
+    if len(data) < _HEADER.size or data[:2] != HEADER_MAGIC:
+        return None, 0
+    _, _, stage_count, seq = _HEADER.unpack_from(data)
+    stamps = struct.unpack_from(f'>{stage_count}Q', data, _HEADER.size)
+    return FrameTrace(seq, stamps), _HEADER.size + 8 * stage_count
+
+
+def log_sampled(stream_id, trace):
+    """Write a stage-by-stage latency line for every TRACE_SAMPLE_EVERY-th frame"""
+    if trace.seq % TRACE_SAMPLE_EVERY:
+        return
+    stages = ' '.join(
+        f"{stage}={ms:.2f}" if ms is not None else f"{stage}=-"
+        for stage, ms in trace.breakdown().items()
+    )
+    logger.info(f"trace stream={stream_id} seq={trace.seq} {stages}")
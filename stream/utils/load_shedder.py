@@ -0,0 +1,211 @@
+import os
+import threading
+import time
+import logging
+from collections import deque
+
+from django.conf import settings
+
+logger = logging.getLogger('load_shedder')
+
+# What a pipeline gives up at each shed level, cheapest loss first: detection only runs
+# on every detect_every-th processed frame, re-encoded frames use encode_quality
+# (PIL, 1-95) and only every frame_every-th frame read from ffmpeg is processed at all
+SHED_LEVELS = (
+    {'detect_every': 1, 'encode_quality': 85, 'frame_every': 1},
+    {'detect_every': 2, 'encode_quality': 85, 'frame_every': 1},
+    {'detect_every': 4, 'encode_quality': 70, 'frame_every': 1},
+    {'detect_every': 4, 'encode_quality': 60, 'frame_every': 2},
+    {'detect_every': 8, 'encode_quality': 50, 'frame_every': 3},
+)
+MAX_SHED_LEVEL = len(SHED_LEVELS) - 1
+
+CONTROL_INTERVAL = 1.0
+# Minimum time between two steps, restoring is slower so the controller doesn't oscillate
+SHED_COOLDOWN = 3.0
+RESTORE_COOLDOWN = 15.0
+# Share of a pipeline's frame budget (1 / fps) spent processing a frame
+UTILIZATION_HIGH = 0.9
+UTILIZATION_LOW = 0.4
+DECISION_LOG_SIZE = 200
+
+
+class HostCpuSampler:
+    """Busy share of all CPUs since the previous sample, from /proc/stat or else the load average"""
+
+    def __init__(self):
+        self._last = None
+
+    def _read_proc_stat(self):
+        try:
+            with open('/proc/stat', 'rb') as stat_file:
+                fields = [int(value) for value in stat_file.readline().split()[1:]]
+        except (OSError, ValueError):
+            return None
+        idle = fields[3] + (fields[4] if len(fields) > 4 else 0)  # idle + iowait
+        return sum(fields), idle
+
+    def sample(self):
+        current = self._read_proc_stat()
+        if current is None:
+            return os.getloadavg()[0] / (os.cpu_count() or 1)
+        last, self._last = self._last, current
+        if last is None or current[0] <= last[0]:
+            return os.getloadavg()[0] / (os.cpu_count() or 1)
+        total, idle = current[0] - last[0], current[1] - last[1]
+        return 1.0 - idle / total
+
+
+class LoadShedder:
+    """
+        Node-wide controller that keeps pipelines within their frame budget.
+
+        Two kinds of pressure are handled: a single pipeline whose loop needs more
+        than its frame budget is shed on its own, whatever its priority. When the
+        host CPU is saturated the lowest priority streams are shed first. Levels are
+        stepped one at a time and restored, highest priority first, once the host
+        and the pipeline have headroom again. Every step is kept in a decision log.
+    """
+
+    def __init__(self, high=0.9, low=0.6):
+        self.high = high
+        self.low = low
+        self.enabled = True
+        self.pipelines = {}  # stream_id -> RTSPClient or ShardedStreamClient
+        self.decisions = deque(maxlen=DECISION_LOG_SIZE)
+        self.host_cpu = 0.0
+        self._sampler = HostCpuSampler()
+        self._last_step = {}  # stream_id -> monotonic time of its last level change
+        self._last_global_step = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def register(self, pipeline):
+        with self._lock:
+            self.pipelines[pipeline.stream_id] = pipeline
+            if self._thread is None and self.enabled:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def unregister(self, pipeline):
+        with self._lock:
+            if self.pipelines.get(pipeline.stream_id) is pipeline:
+                del self.pipelines[pipeline.stream_id]
+                self._last_step.pop(pipeline.stream_id, None)
+
+    def record(self, decision):
+        self.decisions.append(decision)
+
+    def _run(self):
+        while True:
+            time.sleep(CONTROL_INTERVAL)
+            try:
+                self._tick()
+            except Exception as e:
+                logger.error(f"Load shedding step failed: {e}", exc_info=True)
+
+    @staticmethod
+    def _effect(pipeline, level):
+        """What a level changes for a pipeline, detect_every and encode_quality need a detector"""
+        if pipeline.has_detection:
+            return SHED_LEVELS[level]
+        return SHED_LEVELS[level]['frame_every']
+
+    def _shed_target(self, pipeline):
+        """Next level that saves something on this pipeline, None if there is none left"""
+        current = self._effect(pipeline, pipeline.shed_level)
+        for level in range(pipeline.shed_level + 1, MAX_SHED_LEVEL + 1):
+            if self._effect(pipeline, level) != current:
+                return level
+        return None
+
+    def _restore_target(self, pipeline):
+        """Lowest level that gives back the last thing taken from this pipeline"""
+        level = pipeline.shed_level - 1
+        while level > 0 and self._effect(pipeline, level - 1) == self._effect(pipeline, level):
+            level -= 1
+        return level
+
+    def _step(self, pipeline, level, reason):
+        now = time.monotonic()
+        previous = pipeline.shed_level
+        pipeline.set_shed_level(level)
+        self._last_step[pipeline.stream_id] = now
+        self._last_global_step = now
+        decision = {
+            'time': time.time(),
+            'stream_id': pipeline.stream_id,
+            'action': 'shed' if level > previous else 'restore',
+            'from_level': previous,
+            'to_level': level,
+            'settings': SHED_LEVELS[level],
+            'priority': pipeline.priority,
+            'reason': reason,
+            'host_cpu': round(self.host_cpu, 3),
+        }
+        self.record(decision)
+        logger.info(f"{decision['action'].capitalize()} stream {pipeline.stream_id} "
+                    f"level {previous} -> {level}: {reason}")
+
+    def _tick(self):
+        self.host_cpu = self._sampler.sample()
+        now = time.monotonic()
+        with self._lock:
+            pipelines = [p for p in self.pipelines.values() if p.state == 'streaming']
+        utilization = {p.stream_id: p.frame_utilization() for p in pipelines}
+
+        # A loop falling behind its own frame budget only gets worse by waiting
+        for pipeline in pipelines:
+            usage = utilization[pipeline.stream_id]
+            if usage > UTILIZATION_HIGH and now - self._last_step.get(pipeline.stream_id, 0) >= SHED_COOLDOWN:
+                level = self._shed_target(pipeline)
+                if level is not None:
+                    self._step(pipeline, level, f"frame budget {usage:.0%} used")
+
+        if self.host_cpu > self.high:
+            if now - self._last_global_step < SHED_COOLDOWN:
+                return
+            candidates = [p for p in pipelines if self._shed_target(p) is not None]
+            if candidates:
+                # Lowest priority first, the most expensive one among equals
+                victim = min(candidates, key=lambda p: (p.priority, -p.cpu_percent))
+                self._step(victim, self._shed_target(victim), f"host CPU {self.host_cpu:.0%}")
+        elif self.host_cpu < self.low:
+            if now - self._last_global_step < RESTORE_COOLDOWN:
+                return
+            candidates = [
+                p for p in pipelines
+                if p.shed_level > 0 and utilization[p.stream_id] < UTILIZATION_LOW
+                and now - self._last_step.get(p.stream_id, 0) >= RESTORE_COOLDOWN
+            ]
+            if candidates:
+                target = max(candidates, key=lambda p: (p.priority, -p.cpu_percent))
+                self._step(target, self._restore_target(target), f"host CPU {self.host_cpu:.0%}")
+
+    def snapshot(self):
+        return {
+            'enabled': self.enabled,
+            'host_cpu': round(self.host_cpu, 3),
+            'load_average': [round(value, 2) for value in os.getloadavg()],
+            'high': self.high,
+            'low': self.low,
+            'levels': SHED_LEVELS,
+            'decisions': list(self.decisions)[::-1],
+        }
+
+
+_shedder = None
+_shedder_lock = threading.Lock()
+
+
+def get_load_shedder():
+    """The process-wide controller, configured from the LOAD_SHEDDING_* settings"""
+    global _shedder
+    with _shedder_lock:
+        if _shedder is None:
+            _shedder = LoadShedder(
+                high=getattr(settings, 'LOAD_SHEDDING_HIGH', 0.9),
+                low=getattr(settings, 'LOAD_SHEDDING_LOW', 0.6),
+            )
+            _shedder.enabled = getattr(settings, 'LOAD_SHEDDING_ENABLED', True)
+    return _shedder
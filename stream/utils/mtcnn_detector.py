@@ -8,22 +8,110 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+
+def _iou(a, b):
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    ix = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    iy = max(0, min(ay + ah, by + bh) - max(ay, by))
+    intersection = ix * iy
+    union = aw * ah + bw * bh - intersection
+    return intersection / union if union > 0 else 0.0
+
+
 class MTCNNDetector:
-    def __init__(self):
+    # MTCNN's P-Net scans 12x12 windows, asking for smaller faces only upsamples the image
+    MIN_DETECTABLE_FACE = 12
+
+    def __init__(self, detection_width=None, min_face_size=20, regions=None):
         """
             Initialize the detector once per instance of this class
             This ensures that if multiple RTSPClient instances are created,
             each has its own MTCNN detector, which can help with thread safety
             if the underlying DNN models are not fully re-entrant.
+
+            detection_width: run MTCNN on a view downscaled to at most this width
+            min_face_size: smallest face to report, in full-frame pixels
+            regions: optional list of polygons in normalized [0, 1] frame coordinates,
+                     detection only runs on (and only reports faces inside) these regions
         """
+        self.detection_width = detection_width
+        self.min_face_size = min_face_size
+        self.regions = [np.asarray(region, dtype=np.float32) for region in regions or []]
+        # Faces found by the last detection, redrawn on frames that skip detection
+        self.last_faces = []
         try:
-            self.detector = MTCNN_CV2_Lib()
+            self.detector = MTCNN_CV2_Lib(min_face_size=min_face_size)
             logger.info("MTCNN detector initialized successfully.")
         except Exception as e:
             logger.error(f"Failed to initialize MTCNN detector: {e}", exc_info=True)
             self.detector = None
 
-    def detect_faces(self, image_bytes):
+    def _detection_views(self, height, width):
+        """Return (x0, y0, x1, y1, polygon) crops to run detection on, polygon in frame pixels or None"""
+        if not self.regions:
+            return [(0, 0, width, height, None)]
+
+        views = []
+        for region in self.regions:
+            polygon = np.round(region * [width, height]).astype(np.int32)
+            x, y, w, h = cv2.boundingRect(polygon)
+            x0, y0 = max(0, x), max(0, y)
+            x1, y1 = min(width, x + w), min(height, y + h)
+            if x1 - x0 < self.MIN_DETECTABLE_FACE or y1 - y0 < self.MIN_DETECTABLE_FACE:
+                continue
+            views.append((x0, y0, x1, y1, polygon))
+        return views
+
+    def find_faces(self, image_array_rgb):
+        """
+            Run MTCNN on the downscaled/cropped views of a full RGB frame and
+            return faces as (x, y, w, h, confidence) in full-frame coordinates.
+        """
+        faces = []
+        height, width = image_array_rgb.shape[:2]
+
+        for x0, y0, x1, y1, polygon in self._detection_views(height, width):
+            view = image_array_rgb[y0:y1, x0:x1]
+            scale = 1.0
+            if self.detection_width and (x1 - x0) > self.detection_width:
+                scale = self.detection_width / (x1 - x0)
+                view = cv2.resize(view, (self.detection_width, max(1, round((y1 - y0) * scale))),
+                                  interpolation=cv2.INTER_AREA)
+            view = np.ascontiguousarray(view, dtype=np.uint8)
+
+            # min_face_size is in full-frame pixels, MTCNN sees the scaled view
+            self.detector.min_face_size = max(self.MIN_DETECTABLE_FACE, round(self.min_face_size * scale))
+
+            for face in self.detector.detect_faces(view):
+                confidence = face['confidence']
+                # threshold
+                if confidence <= 0.7:
+                    continue
+                bx, by, bw, bh = face['box']
+                # Map the box back from the view to full-frame coordinates
+                x = x0 + round(bx / scale)
+                y = y0 + round(by / scale)
+                w = round(bw / scale)
+                h = round(bh / scale)
+                if min(w, h) < self.min_face_size:
+                    continue
+                if polygon is not None and cv2.pointPolygonTest(polygon, (x + w / 2, y + h / 2), False) < 0:
+                    continue
+                # Overlapping regions can report the same face twice
+                if any(_iou((x, y, w, h), kept[:4]) > 0.5 for kept in faces):
+                    continue
+                faces.append((x, y, w, h, confidence))
+
+        return faces
+
+    def detect_faces(self, image_bytes, trace=None, face_callback=None, jpeg_quality=85, faces=None):
+        """
+            Draw detected faces onto a JPEG frame, trace (FrameTrace) gets the detect/encode stages marked.
+            face_callback(image_array_rgb, faces) sees the undrawn frame, e.g. for face embeddings.
+            jpeg_quality is the PIL quality (1-95) the annotated frame is re-encoded with.
+            faces, when given, are drawn instead of running detection (and face_callback).
+        """
         if not self.detector:
             logger.warning("MTCNN detector not initialized, skipping face detection.")
             return image_bytes, False
@@ -68,26 +156,28 @@ class MTCNNDetector:
                 return image_bytes, False
 
             # MTCNN expects RGB format, which image_array_rgb should be.
-            result = self.detector.detect_faces(image_array_rgb)
-            
-            for face in result:
-                bounding_box = face['box']
-                # keypoints = face['keypoints']
-                confidence = face['confidence']
-                # threshold 
-                if confidence > 0.7: 
-                    x, y, w, h = bounding_box
-                    cv2.rectangle(image_array_rgb, (x, y), (x + w, y + h), (0, 255, 0), 2)
-                    cv2.putText(image_array_rgb, f'{confidence:.2f}', 
-                              (x, y - 10),
-                              cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1)
+            if faces is None:
+                faces = self.find_faces(image_array_rgb)
+                self.last_faces = faces
+                if face_callback and faces:
+                    face_callback(image_array_rgb, faces)
+            if trace:
+                trace.mark('detect')
+
+            for x, y, w, h, confidence in faces:
+                cv2.rectangle(image_array_rgb, (x, y), (x + w, y + h), (0, 255, 0), 2)
+                cv2.putText(image_array_rgb, f'{confidence:.2f}', 
+                          (x, y - 10),
+                          cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1)
             
             # Convert back to PIL Image (from RGB numpy array)
             modified_image_pil = Image.fromarray(image_array_rgb)
             
             # Convert to bytes (JPEG format)
             img_byte_arr = io.BytesIO()
-            modified_image_pil.save(img_byte_arr, format='JPEG', quality=85)
+            modified_image_pil.save(img_byte_arr, format='JPEG', quality=jpeg_quality)
+            if trace:
+                trace.mark('encode')
             
             return img_byte_arr.getvalue(), True
             
@@ -0,0 +1,140 @@
+import os
+import queue
+import signal
+import time
+import logging
+import multiprocessing
+
+logger = logging.getLogger('pipeline_worker')
+
+# How often each worker reports runtime status of its pipelines to the ASGI process
+STATUS_INTERVAL = 1.0
+
+
+def _worker_client_class():
+    # Imported after django.setup(), RTSPClient pulls in channels
+    from .rtsp_client import RTSPClient
+
+    class WorkerRTSPClient(RTSPClient):
+        """RTSPClient that hands its output to the ASGI process instead of the channel layer"""
+
+        def __init__(self, stream_id, url, group_name, config, ring, events):
+            super().__init__(stream_id, url, group_name, config)
+            self.ring = ring
+            self.events = events
+            self.frames_oversized = 0
+
+        def _publish(self, event):
+            if event['type'] == 'stream_frame':
+                frame = event.pop('frame')
+                location = self.ring.write(frame)
+                if location is None:
+                    self.frames_oversized += 1
+                    logger.warning(f"Frame of {len(frame)} bytes for stream {self.stream_id} doesn't fit a ring slot, dropped")
+                    return
+                event['slot'], event['ring_seq'] = location
+            self.events.put((self.stream_id, event))
+
+        def _observe_faces(self, embeddings):
+            # The gallery lives in the ASGI process so identities are shared across workers
+            self.events.put((self.stream_id, {'type': 'face_embeddings', 'embeddings': embeddings}))
+
+        def worker_status(self):
+            status = self.runtime_status()
+            # Lets the ASGI process kill a crashed worker's ffmpeg process group
+            process = self.process
+            status['ffmpeg_pid'] = process.pid if process else None
+            # Input to the ASGI process's load shedder, which decides for all workers at once
+            status['frame_utilization'] = round(self.frame_utilization(), 3)
+            return status
+
+    return WorkerRTSPClient
+
+
+def worker_main(worker_index, ring_name, ring_slots, slot_size, commands, events):
+    """
+        Entry point of a pipeline worker process. Runs RTSPClient pipelines for the
+        streams assigned to it and publishes their frames into the shared ring.
+
+        Commands are tuples on the commands queue:
+            ('start', stream_id, url, group_name, config)
+            ('add_client', stream_id) / ('remove_client', stream_id)
+            ('reconfigure', stream_id, url, config)
+            ('set_shed_level', stream_id, level)
+            ('shutdown',)
+    """
+    # Ctrl-C goes to the whole process group, let the ASGI process decide when we stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'rtsppy.settings')
+    import django
+    django.setup()
+
+    from .frame_ring import FrameRing
+    from .load_shedder import get_load_shedder
+    WorkerRTSPClient = _worker_client_class()
+    # Shedding is decided in the ASGI process across all workers, pipelines here only apply the level
+    get_load_shedder().enabled = False
+
+    ring = FrameRing(ring_name, ring_slots, slot_size)
+    clients = {}
+    parent = multiprocessing.parent_process()
+    last_status = 0
+    logger.info(f"Pipeline worker {worker_index} started (PID: {os.getpid()})")
+
+    while True:
+        try:
+            command = commands.get(timeout=0.5)
+        except queue.Empty:
+            command = None
+
+        if command:
+            action, stream_id = command[0], command[1] if len(command) > 1 else None
+            client = clients.get(stream_id)
+            if action == 'shutdown':
+                break
+            elif action == 'start':
+                _, _, url, group_name, config = command
+                if client is None or not client.is_running:
+                    client = WorkerRTSPClient(stream_id, url, group_name, config, ring, events)
+                    clients[stream_id] = client
+                    client.start()
+                else:
+                    # The ASGI process released this stream and starts it again at level 0, with
+                    # settings that may have changed while the pipeline was draining or suspended
+                    client.set_shed_level(0)
+                    client.reconfigure(url, config)
+                    client.add_client()
+            elif client is None:
+                logger.warning(f"Worker {worker_index} got {action} for unknown stream {stream_id}")
+            elif action == 'add_client':
+                client.add_client()
+            elif action == 'remove_client':
+                client.remove_client()
+            elif action == 'reconfigure':
+                _, _, url, config = command
+                client.reconfigure(url, config)
+            elif action == 'set_shed_level':
+                client.set_shed_level(command[2])
+
+        now = time.monotonic()
+        if now - last_status >= STATUS_INTERVAL:
+            last_status = now
+            for stream_id, client in list(clients.items()):
+                if not client.is_running and client.client_count == 0:
+                    del clients[stream_id]
+                    continue
+                events.put((stream_id, {'type': 'pipeline_status', 'status': client.worker_status()}))
+
+        if parent is not None and not parent.is_alive():
+            logger.warning(f"Pipeline worker {worker_index} lost its parent process, exiting")
+            break
+
+    # Each stream loop stops its own ffmpeg on the way out, stopping it from here races the loop
+    for client in clients.values():
+        client.is_running = False
+    for client in clients.values():
+        if client.thread:
+            client.thread.join(timeout=5.0)
+    ring.close()
+    logger.info(f"Pipeline worker {worker_index} stopped")
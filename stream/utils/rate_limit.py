@@ -0,0 +1,45 @@
+import time
+
+
+class FrameRateLimiter:
+    """
+        Decimates a frame sequence down to at most max_fps for one viewer.
+        Keeps the long-run average close to max_fps even when the source
+        frame interval doesn't divide evenly into the target interval.
+    """
+
+    def __init__(self, max_fps=None):
+        self.max_fps = max_fps
+        self._next_time = 0
+
+    def set_max_fps(self, max_fps):
+        self.max_fps = max_fps
+        self._next_time = 0
+
+    def allow(self, now=None):
+        """Return True if a frame arriving now should be sent"""
+        if not self.max_fps:
+            return True
+        if now is None:
+            now = time.monotonic()
+        if now < self._next_time:
+            return False
+        interval = 1.0 / self.max_fps
+        if now - self._next_time < interval:
+            # On schedule, advance the schedule so the average stays at max_fps
+            self._next_time += interval
+        else:
+            # Restart the schedule after an idle period instead of sending a burst
+            self._next_time = now + interval
+        return True
+
+
+def parse_max_fps(value):
+    """Parse a viewer-supplied max fps, None (unlimited) for missing or invalid values"""
+    try:
+        max_fps = float(value)
+    except (TypeError, ValueError):
+        return None
+    if max_fps <= 0:
+        return None
+    return min(max_fps, 60.0)
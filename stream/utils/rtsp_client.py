@@ -2,158 +2,561 @@ import threading
 import time
 import subprocess
 import os
-import signal
+import select
 import logging
+from collections import deque
 
 from asgiref.sync import async_to_sync
 from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
 from .mtcnn_detector import MTCNNDetector
+from .frame_diff import FrameChangeDetector
+from .frame_trace import FrameTrace
+from .face_embedder import FaceEmbedder
+from .face_gallery import get_face_gallery
+from .load_shedder import SHED_LEVELS, get_load_shedder
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger('rtsp_client')
 
+_CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+
+def process_cpu_seconds(pid):
+    """User + system CPU time of a process from /proc, None where that isn't available"""
+    try:
+        with open(f'/proc/{pid}/stat', 'rb') as stat_file:
+            stat = stat_file.read()
+    except OSError:
+        return None
+    # The command name may contain spaces, fields after it are space separated
+    fields = stat[stat.rfind(b')') + 2:].split()
+    return (int(fields[11]) + int(fields[12])) / _CLOCK_TICKS
+
+JPEG_START = b'\xff\xd8'
+JPEG_END = b'\xff\xd9'
+
+# Defaults for settings that can be overridden per stream (see Stream.pipeline_config)
+DEFAULT_PIPELINE_CONFIG = {
+    'fps': 15,
+    'scale_width': 640,
+    'jpeg_quality': 10,       # ffmpeg -q:v, lower is better, 2-31
+    'decoder_threads': None,  # None = derived from cpu count
+    'detection_enabled': True,
+    'detection': {},          # MTCNNDetector keyword arguments
+    'embeddings_enabled': False,  # Match detected faces against the face gallery
+    'change_threshold': 2.0,  # Frames closer than this to the last sent one are skipped, 0 sends everything
+    'refresh_interval': 10.0, # Resend an unchanged frame at least this often (seconds)
+    'priority': 0,            # Higher priority streams are shed last under CPU pressure
+    'source': {},             # Cached ffprobe metadata: codec, width, height, fps, transport
+    'mode': 'full',           # 'preview' decodes keyframes only, without detection (see PREVIEW_MODE)
+    'preview_width': 320,
+    'preview_quality': 12,
+}
+
+# Low-power thumbnail pipeline: ffmpeg only decodes keyframes, so frames arrive at
+# the camera's GOP interval, small and without face detection
+PREVIEW_MODE = 'preview'
+
+TRANSPORT_TYPES = ('tcp', 'udp')
+
+# Settings that only take effect by restarting ffmpeg
+FFMPEG_SETTINGS = ('fps', 'scale_width', 'jpeg_quality', 'decoder_threads', 'mode', 'preview_width', 'preview_quality')
+
+# While frames are suppressed, tell viewers the stream is alive this often (seconds)
+HEARTBEAT_INTERVAL = 2.0
+
+# Compute face embeddings at most this often per stream (seconds)
+EMBEDDING_INTERVAL = 1.0
+
+# How often the loop samples CPU usage of its ffmpeg process and itself (seconds)
+CPU_SAMPLE_INTERVAL = 1.0
+
+# How long a replacement ffmpeg process gets to produce its first frame
+SWAP_TIMEOUT = 15.0
+
+# Longest the loop waits for ffmpeg output before it checks for swaps, viewers and
+# stop requests again, so a silent ffmpeg can't hold it up
+READ_TIMEOUT = 0.5
+
+
 class RTSPClient:
-    def __init__(self, stream_id, url, group_name):
+    def __init__(self, stream_id, url, group_name, config=None):
         self.stream_id = stream_id
         self.url = url
         self.group_name = group_name
         self.is_running = False
         self.thread = None
         self.process = None
+        self.transport = None
         self.channel_layer = get_channel_layer()
         self.client_count = 0
         self.last_frame_time = 0
-        self.fps = 15
         self.frame_buffer = None
-        self.face_detector = MTCNNDetector()
+        self.frame_buffer_trace = None
+        self.frame_seq = 0
+        self.state = 'stopped'
+        self.started_at = None
+        # Recent read/send times for measuring fps
+        self._read_times = deque(maxlen=32)
+        self._send_times = deque(maxlen=32)
+        self.config = {**DEFAULT_PIPELINE_CONFIG, **(config or {})}
+        self.fps = self.config['fps']
+        self.face_detector = self._create_detector(self.config)
+        self.face_embedder = self._create_embedder(self.config)
+        self.last_embedding_time = 0
+        self.change_detector = FrameChangeDetector(self.config['change_threshold'], self.config['refresh_interval'])
+        self.frames_suppressed = 0
+        self.frames_skipped_stale = 0
+        self.last_heartbeat_time = 0
+        # Load shedding, the level is set by the node-wide LoadShedder
+        self.load_shedder = get_load_shedder()
+        self.shed_level = 0
+        self.frames_shed = 0
+        self._frames_processed = 0
+        self._processing_times = deque(maxlen=32)
+        # Idle handling: with no viewers the pipeline drains ffmpeg's output, then
+        # stops ffmpeg (suspended), then tears down (see _handle_idle)
+        self.idle_since = None
+        self.suspend_after = getattr(settings, 'STREAM_IDLE_SUSPEND_AFTER', 10.0)
+        self.teardown_after = getattr(settings, 'STREAM_IDLE_TEARDOWN_AFTER', 120.0)
+        self.cpu_percent = 0.0
+        self.idle_cpu_seconds = 0.0
+        self._cpu_sample = None  # (monotonic time, cpu seconds)
+        # (process, buffer, url, config) prepared by reconfigure(), picked up by _stream_loop
+        self._pending_swap = None
+        self._swap_lock = threading.Lock()
+        self._swap_thread = None
         
     def start(self):
         self.client_count += 1
         logger.info(f"Client joined stream {self.stream_id} - Total clients: {self.client_count}")
         
         if self.is_running:
-            # If already running, and we have a frame buffer, send it to the new client
-            if self.frame_buffer:
-                logger.info(f"Sending buffered frame to new client for stream {self.stream_id}")
-                self._send_frame(self.frame_buffer)
+            # The consumer sends frame_buffer to the new client directly
             return
         
         self.is_running = True
+        self.idle_since = None
+        self.state = 'connecting'
+        self.started_at = time.time()
         self.thread = threading.Thread(target=self._stream_loop)
         self.thread.daemon = True
         self.thread.start()
+        if self.config['mode'] != PREVIEW_MODE:
+            # Preview pipelines have nothing left to shed
+            self.load_shedder.register(self)
         logger.info(f"Started stream {self.stream_id}")
     
     def add_client(self):
         self.client_count += 1
         logger.info(f"Client joined stream {self.stream_id} - Total clients: {self.client_count}")
-        # If stream is running and we have a frame buffer, send it
-        if self.is_running and self.frame_buffer:
-            logger.info(f"Sending buffered frame to new client for stream {self.stream_id}")
-            self._send_frame(self.frame_buffer)
+        # The consumer sends frame_buffer to the new client directly, the other
+        # viewers already have it
 
     def remove_client(self):
         if self.client_count > 0:
             self.client_count -= 1
         logger.info(f"Client left stream {self.stream_id} - Remaining clients: {self.client_count}")
         
-        # Consider stopping the stream if no clients are left after a short delay
-        # This part of your logic seemed a bit complex with _shutdown, simplifying:
+        # The stream loop drains, stops ffmpeg and eventually tears the pipeline down
         if self.client_count == 0 and self.is_running:
-            logger.info(f"No clients for stream {self.stream_id}, scheduling stop.")
-            # A simple delay before stopping to handle quick reconnects
-            threading.Timer(5.0, self._check_and_stop).start() 
+            logger.info(f"No clients for stream {self.stream_id}, going idle.")
+            self.idle_since = time.monotonic()
 
-    def _check_and_stop(self):
-        if self.client_count == 0 and self.is_running:
-            logger.info(f"Stopping stream {self.stream_id} due to no clients.")
-            self._stop_stream()
-            
-    def _stream_loop(self):
-        logger.info(f"Starting optimized stream loop for {self.stream_id}")
-        
-        transport_types = ['tcp', 'udp']
-        success = False
-        
-        cpu_count = os.cpu_count() or 4
-        thread_count = max(1, min(cpu_count // 2, 4))
+    def _handle_idle(self):
+        """
+        Called from the stream loop while there are no viewers. Returns False once
+        the pipeline should be torn down, otherwise whether to keep reading ffmpeg.
+        """
+        if self.idle_since is None:
+            self.idle_since = time.monotonic()
+        idle_for = time.monotonic() - self.idle_since
 
-        logger.info(f"RTSP URL: {self.url}")
-        
-        base_command = [
+        if idle_for >= self.teardown_after:
+            logger.info(f"Stream {self.stream_id} idle for {idle_for:.0f}s, tearing down.")
+            return False
+
+        if self.state == 'streaming':
+            logger.info(f"Stream {self.stream_id} has no viewers, draining.")
+            self.state = 'draining'
+            self.idle_cpu_seconds = 0.0
+            # Don't hand a stale frame to the next viewer, a fresh one follows the resume
+            self.frame_buffer = None
+        elif self.state == 'draining' and idle_for >= self.suspend_after:
+            # ffmpeg is stopped rather than paused: a paused one sends no RTSP keepalives,
+            # so the camera drops the session, and its socket fills with stale video
+            logger.info(f"Stream {self.stream_id} idle for {idle_for:.0f}s, stopping FFmpeg until a viewer returns.")
+            process, self.process = self.process, None
+            if process:
+                self._terminate_process(process)
+            swap = self._take_pending_swap()
+            if swap:
+                # Keep the new settings for the restart, not the process
+                self._terminate_process(swap[0])
+                self.url, self.config = swap[2], swap[3]
+                self.fps = self.config['fps']
+            self.state = 'suspended'
+        return True
+
+    def _resume(self):
+        """Back to streaming when a viewer returns, False if ffmpeg could not be restarted"""
+        logger.info(f"Resuming stream {self.stream_id} from {self.state}.")
+        if self.state == 'suspended':
+            # The transport that worked before, no need to try them all again
+            transport = self.transport or TRANSPORT_TYPES[0]
+            try:
+                self.process = self._spawn_ffmpeg(self.url, transport, self.config)
+            except Exception as e:
+                logger.error(f"Failed to restart FFmpeg for {self.stream_id}: {e}")
+                self._send_error(f"Failed to restart stream: {e}")
+                return False
+        self.state = 'streaming'
+        self.idle_since = None
+        # Make sure the first fresh frame goes out even if the scene didn't change
+        self.change_detector.reset()
+        return True
+
+    def _sample_cpu(self):
+        """Update cpu_percent (ffmpeg + this loop's thread) and idle_cpu_seconds"""
+        now = time.monotonic()
+        if self._cpu_sample and now - self._cpu_sample[0] < CPU_SAMPLE_INTERVAL:
+            return
+        process = self.process
+        ffmpeg_cpu = process_cpu_seconds(process.pid) if process else None
+        total = time.thread_time() + (ffmpeg_cpu or 0.0)
+        if self._cpu_sample:
+            last_time, last_total = self._cpu_sample
+            delta = max(0.0, total - last_total)
+            self.cpu_percent = delta / (now - last_time) * 100
+            if self.state in ('draining', 'suspended'):
+                self.idle_cpu_seconds += delta
+        self._cpu_sample = (now, total)
+
+    @property
+    def priority(self):
+        return self.config['priority']
+
+    @property
+    def has_detection(self):
+        # Without a detector only frame_every of a shed level changes anything
+        return self.face_detector is not None
+
+    def set_shed_level(self, level):
+        self.shed_level = level
+        # Processing times measured at the old level say nothing about the new one
+        self._processing_times.clear()
+
+    def frame_utilization(self):
+        """Share of the frame budget (1 / fps) the loop spends per frame, above 1 it falls behind"""
+        if len(self._processing_times) < 4 or not self.fps:
+            return 0.0
+        mean = sum(self._processing_times) / len(self._processing_times)
+        return mean * self.fps / SHED_LEVELS[self.shed_level]['frame_every']
+
+    def _create_detector(self, config):
+        if not config['detection_enabled'] or config['mode'] == PREVIEW_MODE:
+            return None
+        return MTCNNDetector(**config['detection'])
+
+    def _create_embedder(self, config):
+        if not config['detection_enabled'] or not config['embeddings_enabled'] or config['mode'] == PREVIEW_MODE:
+            return None
+        return FaceEmbedder.from_settings()
+
+    def _on_faces(self, image_array_rgb, faces):
+        """Embed detected faces (rate limited) and hand them to the face gallery"""
+        embedder = self.face_embedder
+        now = time.monotonic()
+        if embedder is None or now - self.last_embedding_time < EMBEDDING_INTERVAL:
+            return
+        self.last_embedding_time = now
+        try:
+            embeddings = embedder.embed(image_array_rgb, faces)
+        except Exception as e:
+            logger.error(f"Face embedding failed for {self.stream_id}: {e}", exc_info=True)
+            return
+        if len(embeddings):
+            self._observe_faces(embeddings)
+
+    def _observe_faces(self, embeddings):
+        """Record embeddings in the gallery, overridden when running in a worker process"""
+        get_face_gallery().observe(self.stream_id, embeddings)
+
+    @staticmethod
+    def _effective_settings(config):
+        """(fps, scale_width, decoder threads) adjusted to the probed source, if known"""
+        source = config['source']
+        fps, scale_width = config['fps'], config['scale_width']
+        # The fps filter duplicates frames above the source rate, and upscaling only costs
+        if source.get('fps'):
+            fps = min(fps, max(1, round(source['fps'])))
+        if source.get('width'):
+            scale_width = min(scale_width, source['width'])
+
+        thread_count = config['decoder_threads']
+        if not thread_count:
+            cpu_count = os.cpu_count() or 4
+            thread_count = max(1, min(cpu_count // 2, 4))
+            if source.get('width') and source.get('height'):
+                # Slice threads don't pay off on small frames
+                pixels = source['width'] * source['height']
+                thread_count = min(thread_count, 1 if pixels <= 640 * 480 else 2 if pixels <= 1280 * 720 else 4)
+        return fps, scale_width, thread_count
+
+    def _build_preview_command(self, url, transport, config):
+        width = config['preview_width']
+        if config['source'].get('width'):
+            width = min(width, config['source']['width'])
+        return [
+            "ffmpeg",
+            "-rtsp_transport", transport,
+            "-fflags", "nobuffer",
+            "-flags", "low_delay",
+            "-loglevel", "error",
+            "-skip_frame", "nokey",          # Decoder drops everything but keyframes, before any work is done
+            "-threads", "1",                 # One keyframe per GOP, nothing to parallelize
+            "-i", url,
+            "-an",
+            "-f", "mjpeg",
+            "-q:v", str(config['preview_quality']),
+            "-vf", f"scale={width}:-1",      # No fps filter, it would duplicate keyframes up to the target rate
+            "-vsync", "passthrough",
+            "-flush_packets", "1",
+            "-"
+        ]
+
+    def _build_command(self, url, transport, config):
+        if config['mode'] == PREVIEW_MODE:
+            return self._build_preview_command(url, transport, config)
+        fps, scale_width, thread_count = self._effective_settings(config)
+
+        return [
             "ffmpeg",                        # Call FFmpeg executable
-            "-rtsp_transport", "",           # Specify RTSP transport protocol (e.g., tcp, udp) — empty here, likely to be filled dynamically
+            "-rtsp_transport", transport,    # Specify RTSP transport protocol (e.g., tcp, udp)
             "-fflags", "nobuffer",           # Disable buffering to reduce latency
             "-flags", "low_delay",           # Enable low delay mode for real-time streaming
+            "-loglevel", "error",            # Keep stderr quiet, nobody reads it while the stream runs
             "-hwaccel", "auto",              # Use hardware acceleration if available
             "-threads", str(thread_count),   # Set number of threads for decoding (passed dynamically)
-            "-i", self.url,                  # Input stream URL (RTSP in this case)
+            "-i", url,                       # Input stream URL (RTSP in this case)
             "-an",                           # Disable audio processing (no audio)
             "-f", "mjpeg",                   # Set output format to MJPEG (Motion JPEG)
-            "-q:v", "10",                     # Set video quality (lower is better, 1 is highest quality)
-            "-vf", f"scale=640:-1,fps={self.fps}",  # Apply video filters: scale to 640px width (maintain aspect ratio), set target FPS
+            "-q:v", str(config['jpeg_quality']),  # Set video quality (lower is better, 1 is highest quality)
+            "-vf", f"scale={scale_width}:-1,fps={fps}",  # Apply video filters: scale width (maintain aspect ratio), set target FPS
             "-vsync", "passthrough",         # Pass through frames without modifying timing (avoid frame duplication/dropping)
             "-flush_packets", "1",           # Flush packets immediately to reduce latency
             "-"                              # Output to stdout (for piping or in-memory handling)
         ]
 
+    def _spawn_ffmpeg(self, url, transport, config):
+        return subprocess.Popen(
+            self._build_command(url, transport, config),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE, # Capture stderr
+            bufsize=0, # Unbuffered, the loop reads the fd directly so no stale frames pile up in Python
+            preexec_fn=os.setsid
+        )
+
+    def reconfigure(self, url, config):
+        """
+        Apply new settings to a running pipeline without dropping viewers.
+        Detection settings are swapped in place, ffmpeg settings start a replacement
+        process which only takes over once it has produced a frame.
+        """
+        new_config = {**DEFAULT_PIPELINE_CONFIG, **config}
+        restart_ffmpeg = url != self.url or any(new_config[key] != self.config[key] for key in FFMPEG_SETTINGS)
+
+        detection_keys = ('detection_enabled', 'detection', 'embeddings_enabled')
+        if any(new_config[key] != self.config[key] for key in detection_keys):
+            self.face_detector = self._create_detector(new_config)
+            self.face_embedder = self._create_embedder(new_config)
+            self.config = {**self.config, **{key: new_config[key] for key in detection_keys}}
+            logger.info(f"Updated detection settings for stream {self.stream_id}")
+
+        self.change_detector.threshold = new_config['change_threshold']
+        self.change_detector.refresh_interval = new_config['refresh_interval']
+
+        if not restart_ffmpeg:
+            self.config = new_config
+            return
+
+        if not self.is_running or self.process is None:
+            # Nothing to swap, the next start picks up the new settings
+            self.url = url
+            self.config = new_config
+            self.fps = new_config['fps']
+            return
+
+        self._swap_thread = threading.Thread(target=self._prepare_swap, args=(url, new_config))
+        self._swap_thread.daemon = True
+        self._swap_thread.start()
+
+    def _prepare_swap(self, url, config):
+        transport = self.transport or 'tcp'
+        logger.info(f"Starting replacement FFmpeg for stream {self.stream_id} via {transport.upper()}")
+        try:
+            process = self._spawn_ffmpeg(url, transport, config)
+        except Exception as e:
+            logger.error(f"Failed to start replacement FFmpeg for {self.stream_id}: {e}")
+            self._send_error(f"Failed to apply new settings: {e}")
+            return
+
+        buffer = bytearray()
+        deadline = time.monotonic() + SWAP_TIMEOUT
+        fd = process.stdout.fileno()
+        while self.is_running and time.monotonic() < deadline:
+            readable, _, _ = select.select([fd], [], [], max(0, deadline - time.monotonic()))
+            if not readable:
+                break
+            # Read the raw fd so nothing is left behind in the BufferedReader
+            chunk = os.read(fd, 8096)
+            if not chunk:
+                break
+            buffer.extend(chunk)
+            start_pos = buffer.find(JPEG_START)
+            if start_pos != -1 and buffer.find(JPEG_END, start_pos + len(JPEG_START)) != -1:
+                with self._swap_lock:
+                    superseded, self._pending_swap = self._pending_swap, (process, buffer, url, config)
+                if superseded:
+                    self._terminate_process(superseded[0])
+                logger.info(f"Replacement FFmpeg for stream {self.stream_id} produced its first frame")
+                return
+
+        stderr_output = ''
+        if process.poll() is not None:
+            stderr_output = process.stderr.read().decode(errors='ignore')
+        logger.error(f"Replacement FFmpeg for {self.stream_id} produced no frame, keeping current settings. Stderr: {stderr_output}")
+        self._send_error("Failed to apply new settings, keeping the current ones.")
+        self._terminate_process(process)
+
+    def _take_pending_swap(self):
+        with self._swap_lock:
+            swap, self._pending_swap = self._pending_swap, None
+        return swap
+
+    def _record_connect(self, transport, error=''):
+        """Cache the working transport on the Stream, or mark it unreachable with error when transport is None"""
+        from ..models import Stream
+
+        # Preview pipelines are registered as '<id>-preview'
+        stream_id = str(self.stream_id).partition('-')[0]
+        if transport:
+            fields = {'source_transport': transport, 'probe_status': Stream.PROBE_OK, 'probe_error': ''}
+        else:
+            fields = {'probe_status': Stream.PROBE_UNREACHABLE, 'probe_error': (error or 'Connect failed')[:255]}
+        fields['probed_at'] = timezone.now()
+        try:
+            Stream.objects.filter(id=stream_id).update(**fields)
+        except Exception as e:
+            logger.warning(f"Could not record connect result for stream {self.stream_id}: {e}")
+        finally:
+            close_old_connections()
+
+    def _stream_loop(self):
+        logger.info(f"Starting optimized stream loop for {self.stream_id}")
+        
+        # The last transport known to work goes first, saves a failed attempt on UDP-only cameras
+        known_transport = self.config['source'].get('transport')
+        transport_types = sorted(TRANSPORT_TYPES, key=lambda transport: transport != known_transport)
+        success = False
+        connect_error = ''
+        ffmpeg_unavailable = False
+
+        logger.info(f"RTSP URL: {self.url}")
+
         for transport in transport_types:
             if not self.is_running:
                 break
-                
-            command = base_command.copy()
-            command[command.index("-rtsp_transport") + 1] = transport
             
             logger.info(f"Attempting to connect to {self.stream_id} via {transport.upper()}...")
             self._send_status(f"Connecting via {transport.upper()}...")
             
             try:
-                self.process = subprocess.Popen(
-                    command,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE, # Capture stderr
-                    bufsize=10**8, # Increased buffer for stdout, default might be too small
-                    preexec_fn=os.setsid
-                )
+                self.process = self._spawn_ffmpeg(self.url, transport, self.config)
                 
                 # Check if ffmpeg started successfully after a short delay
                 time.sleep(2) # Give FFmpeg some time to connect or fail
                 if self.process.poll() is None: # If poll() is None, process is running
                     logger.info(f"Successfully connected to {self.stream_id} via {transport.upper()}")
+                    self.transport = transport
+                    self.state = 'streaming'
                     success = True
                     break
                 else:
                     stderr_output = self.process.stderr.read().decode(errors='ignore')
                     logger.error(f"FFmpeg failed to start for {self.stream_id} via {transport.upper()}. Exit code: {self.process.returncode}. Stderr: {stderr_output}")
                     self._send_error(f"FFmpeg failed (transport: {transport.upper()}): {stderr_output[:200]}") # Send part of error
+                    connect_error = stderr_output.strip() or f"ffmpeg exit code {self.process.returncode}"
 
+            except OSError as e:
+                # ffmpeg itself can't run, that says nothing about the camera
+                logger.error(f"Can't run ffmpeg for {self.stream_id}: {e}")
+                self._send_error(f"Can't run ffmpeg: {e}")
+                ffmpeg_unavailable = True
+                break
             except Exception as e:
                 logger.error(f"Connection failed for {self.stream_id} via {transport.upper()}: {str(e)}")
                 self._send_error(f"Connection failed (transport: {transport.upper()}): {str(e)}")
+                connect_error = str(e)
                 continue
 
         if not success:
             logger.error(f"FFmpeg unable to connect to {self.url} using {transport_types}")
             self._send_error(f"FFmpeg unable to connect to {self.url}")
+            if self.is_running and not ffmpeg_unavailable:
+                # Viewers connecting in the next STREAM_DEAD_RETRY_AFTER seconds won't retry
+                self._record_connect(None, connect_error)
             self._stop_stream() # Ensure is_running is set to False
             return
+        # An empty source config means the stream wasn't known to work (not probed or unreachable)
+        if self.transport != known_transport or not self.config['source']:
+            self._record_connect(self.transport)
 
-        jpeg_start = b'\xff\xd8'
-        jpeg_end = b'\xff\xd9'
+        jpeg_start = JPEG_START
+        jpeg_end = JPEG_END
         buffer = bytearray()
         max_buffer_size = 100 * 1024 * 1024  # 10MB max buffer, ensure it's larger than largest possible frame
 
         # frame_interval = 1.0 / self.fps
 
         while self.is_running:
+            self._sample_cpu()
+            draining = False
             if self.client_count == 0:
-                # No clients, FFmpeg might still be running, but we don't process/send.
-                # This also means face detection doesn't run, saving CPU.
-                time.sleep(0.1) # Sleep a bit to avoid busy-waiting
-                continue # Continue checking is_running and client_count
+                # No clients: keep reading ffmpeg so the pipe never fills, but skip
+                # detection and sending. Later, stop ffmpeg and finally tear down.
+                if not self._handle_idle():
+                    break
+                if self.state == 'suspended':
+                    time.sleep(0.1) # Sleep a bit to avoid busy-waiting
+                    continue
+                draining = True
+            elif self.state in ('draining', 'suspended'):
+                if not self._resume():
+                    break
+                buffer.clear()
+
+            swap = self._take_pending_swap()
+            if swap:
+                old_process = self.process
+                self.process, buffer, self.url, self.config = swap
+                self.fps = self.config['fps']
+                logger.info(f"Swapped FFmpeg process for stream {self.stream_id} to apply new settings")
+                self._send_status("Applied new stream settings")
+                self._terminate_process(old_process)
 
             try:
-                chunk = self.process.stdout.read(8096) # Read smaller chunks more frequently
+                fd = self.process.stdout.fileno()
+                readable, _, _ = select.select([fd], [], [], READ_TIMEOUT)
+                if not readable:
+                    # Stalled camera or dead URL, a pending swap can still take over
+                    continue
+                # Whatever is available right now, up to 64 KiB
+                chunk = os.read(fd, 65536)
+                read_ns = time.monotonic_ns()
                 if not chunk:
                     if self.process.poll() is not None: # FFmpeg process terminated
                         stderr_output = self.process.stderr.read().decode(errors='ignore')
@@ -163,6 +566,11 @@ class RTSPClient:
                     time.sleep(0.01) # No data, but process alive, wait briefly
                     continue
                 
+                if draining:
+                    # Discard, parsing resumes at the next JPEG start marker
+                    buffer.clear()
+                    continue
+
                 buffer.extend(chunk)
                 
                 if len(buffer) > max_buffer_size:
@@ -198,19 +606,53 @@ class RTSPClient:
                         continue
 
                     del buffer[:end_pos + len(jpeg_end)] # Consume frame from buffer
+
+                    # Behind (e.g. right after a resume): only the newest complete frame is worth processing
+                    next_start = buffer.find(jpeg_start)
+                    if next_start != -1 and buffer.find(jpeg_end, next_start + len(jpeg_start)) != -1:
+                        self.frames_skipped_stale += 1
+                        continue
+
+                    self.frame_seq += 1
+                    self._read_times.append(time.monotonic())
+                    shedding = SHED_LEVELS[self.shed_level]
+                    if self.frame_seq % shedding['frame_every']:
+                        # Shed under load, dropped before any decoding happens
+                        self.frames_shed += 1
+                        continue
+                    trace = FrameTrace(self.frame_seq)
+                    trace.mark('read', read_ns)
+                    trace.mark('split')
+
+                    # Static scene or frozen camera, skip detection and sending
+                    if not self.change_detector.has_changed(raw_frame_bytes):
+                        self.frames_suppressed += 1
+                        if time.monotonic() - max(self.last_frame_time, self.last_heartbeat_time) >= HEARTBEAT_INTERVAL:
+                            self._send_heartbeat()
+                        continue
+
                     # current_time = time.time()
                     processed_frame_bytes = raw_frame_bytes
-                    if self.face_detector:
+                    face_detector = self.face_detector
+                    self._frames_processed += 1
+                    if face_detector:
+                        # Frames shed from detection still get the last boxes and the same quality,
+                        # otherwise boxes blink and the image flips between qualities
+                        detect = self._frames_processed % shedding['detect_every'] == 0
                         try:
-                            modified_frame_bytes, success = self.face_detector.detect_faces(raw_frame_bytes)
+                            modified_frame_bytes, success = face_detector.detect_faces(
+                                raw_frame_bytes, trace, self._on_faces if self.face_embedder else None,
+                                jpeg_quality=shedding['encode_quality'],
+                                faces=None if detect else face_detector.last_faces
+                            )
                             if success:
                                 processed_frame_bytes = modified_frame_bytes
                         except Exception as e:
                             logger.error(f"Unhandled exception in face detection for {self.stream_id}: {e}", exc_info=True)
                     
                     self.frame_buffer = processed_frame_bytes 
-                    self._send_frame(processed_frame_bytes)
-                    # self.last_frame_time = current_time
+                    self._send_frame(processed_frame_bytes, trace)
+                    self._processing_times.append(trace.elapsed('read'))
                         
                     # else: Skip frame to maintain FPS
             
@@ -225,8 +667,45 @@ class RTSPClient:
         logger.info(f"Stream loop for {self.stream_id} ended.")
         self._stop_stream() # Clean up FFmpeg if loop exits
 
+    @staticmethod
+    def _measured_fps(times):
+        if len(times) < 2:
+            return 0.0
+        last, first = times[-1], times[0]
+        # Don't report a stale rate for a stream that stopped producing frames
+        if time.monotonic() - last > 5.0 or last == first:
+            return 0.0
+        return (len(times) - 1) / (last - first)
+
+    def runtime_status(self):
+        """Snapshot of the live pipeline for the runtime-status API, cheap enough to call per request"""
+        return {
+            'stream_id': self.stream_id,
+            'state': self.state,
+            'viewers': self.client_count,
+            'transport': self.transport,
+            'input_fps': round(self._measured_fps(self._read_times), 2),
+            'output_fps': round(self._measured_fps(self._send_times), 2),
+            'configured_fps': self.fps,
+            'frames_read': self.frame_seq,
+            'frames_suppressed': self.frames_suppressed,
+            'frames_skipped_stale': self.frames_skipped_stale,
+            'cpu_percent': round(self.cpu_percent, 1),
+            'idle_seconds': round(time.monotonic() - self.idle_since, 1) if self.idle_since else None,
+            'idle_cpu_seconds': round(self.idle_cpu_seconds, 2),
+            'detection_enabled': self.has_detection,
+            'started_at': self.started_at,
+            'mode': self.config['mode'],
+            'priority': self.priority,
+            'shed_level': self.shed_level,
+            'frames_shed': self.frames_shed,
+        }
+
     def _stop_stream(self):
         self.is_running = False
+        self.load_shedder.unregister(self)
+        self.shed_level = 0
+        self.state = 'stopped'
         
         original_process = self.process
         pid = original_process.pid if original_process else None
@@ -235,49 +714,78 @@ class RTSPClient:
         self.frame_buffer = None
 
         if original_process and pid:
-            logger.info(f"Attempting to stop FFmpeg process for stream {self.stream_id} (PID: {pid}).")
-            try:
-                if original_process.poll() is None: # Check if it's running
-                    original_process.terminate()
-                    try:
-                        # Brief wait for terminate to take effect
-                        original_process.wait(timeout=1.0) 
-                    except subprocess.TimeoutExpired:
-                        logger.warning(f"FFmpeg process {pid} (stream {self.stream_id}) didn't terminate quickly. Killing.")
-                        if original_process.poll() is None: # Check again before kill
-                           original_process.kill()
-                           original_process.wait(timeout=1.0) # Brief wait for kill
-                    except Exception: # Catch if wait fails (e.g., process died before wait)
-                        pass # Already stopped or error during wait, proceed
-                
-                if original_process.poll() is None:
-                    logger.error(f"FFmpeg process {pid} (stream {self.stream_id}) may still be running after stop attempts.")
-                else:
-                    logger.info(f"FFmpeg process {pid} (stream {self.stream_id}) stopped or was already stopped. Return code: {original_process.returncode}")
-
-            except Exception as e:
-                logger.error(f"Error during FFmpeg stop for stream {self.stream_id} (PID: {pid}): {e}")
+            self._terminate_process(original_process)
         else:
             logger.info(f"No FFmpeg process to stop for stream {self.stream_id}, or it was already cleared.")
+
+        swap = self._take_pending_swap()
+        if swap:
+            self._terminate_process(swap[0])
         
         logger.info(f"Stream {self.stream_id} cleanup attempt complete. is_running: {self.is_running}")
 
-    def _send_frame(self, frame_bytes):
+    def _terminate_process(self, process):
+        pid = process.pid
+        logger.info(f"Attempting to stop FFmpeg process for stream {self.stream_id} (PID: {pid}).")
+        try:
+            if process.poll() is None: # Check if it's running
+                process.terminate()
+                try:
+                    # Brief wait for terminate to take effect
+                    process.wait(timeout=1.0) 
+                except subprocess.TimeoutExpired:
+                    logger.warning(f"FFmpeg process {pid} (stream {self.stream_id}) didn't terminate quickly. Killing.")
+                    if process.poll() is None: # Check again before kill
+                       process.kill()
+                       process.wait(timeout=1.0) # Brief wait for kill
+                except Exception: # Catch if wait fails (e.g., process died before wait)
+                    pass # Already stopped or error during wait, proceed
+            
+            if process.poll() is None:
+                logger.error(f"FFmpeg process {pid} (stream {self.stream_id}) may still be running after stop attempts.")
+            else:
+                logger.info(f"FFmpeg process {pid} (stream {self.stream_id}) stopped or was already stopped. Return code: {process.returncode}")
+
+        except Exception as e:
+            logger.error(f"Error during FFmpeg stop for stream {self.stream_id} (PID: {pid}): {e}")
+
+    def _publish(self, event):
+        """Deliver an event to the stream's viewers, overridden when running in a worker process"""
+        async_to_sync(self.channel_layer.group_send)(self.group_name, event)
+
+    def _send_frame(self, frame_bytes, trace):
+        self.last_frame_time = time.monotonic()
+        self._send_times.append(self.last_frame_time)
+        trace.mark('enqueue')
+        self.frame_buffer_trace = trace
         try:
-            async_to_sync(self.channel_layer.group_send)(
-                self.group_name,
+            self._publish(
                 {
                     "type": "stream_frame",
                     "frame": frame_bytes, # Send raw bytes
+                    "stream_id": self.stream_id,
+                    "seq": trace.seq,
+                    "trace": trace.stamps,
                 }
             )
         except Exception as e:
             logger.error(f"Error sending frame for {self.stream_id}: {str(e)}")
 
+    def _send_heartbeat(self):
+        self.last_heartbeat_time = time.monotonic()
+        try:
+            self._publish(
+                {
+                    "type": "stream_heartbeat",
+                    "stream_id": self.stream_id
+                }
+            )
+        except Exception as e:
+            logger.error(f"Error sending heartbeat for {self.stream_id}: {str(e)}")
+
     def _send_status(self, message):
         try:
-            async_to_sync(self.channel_layer.group_send)(
-                self.group_name,
+            self._publish(
                 {
                     "type": "stream_status",
                     "message": message,
@@ -289,8 +797,7 @@ class RTSPClient:
 
     def _send_error(self, message):
         try:
-            async_to_sync(self.channel_layer.group_send)(
-                self.group_name,
+            self._publish(
                 {
                     "type": "stream_error",
                     "message": message,
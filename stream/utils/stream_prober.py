@@ -0,0 +1,183 @@
+import json
+import subprocess
+import threading
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+logger = logging.getLogger('stream_prober')
+
+TRANSPORTS = ('tcp', 'udp')
+
+
+class ProbeError(Exception):
+    pass
+
+
+class ProberUnavailable(Exception):
+    """ffprobe itself can't run, says nothing about the stream"""
+
+
+def _parse_rate(rate):
+    """ffprobe frame rates are fractions such as '30000/1001', '0/0' when unknown"""
+    try:
+        numerator, _, denominator = rate.partition('/')
+        value = float(numerator) / float(denominator or 1)
+    except (AttributeError, ValueError, ZeroDivisionError):
+        return None
+    return round(value, 3) if value > 0 else None
+
+
+def probe_url(url, transport=None, timeout=10.0):
+    """Codec, resolution and frame rate of the first video stream of a source"""
+    command = ['ffprobe', '-v', 'error']
+    if transport:
+        command += ['-rtsp_transport', transport]
+    command += [
+        '-select_streams', 'v:0',
+        '-show_entries', 'stream=codec_name,width,height,avg_frame_rate,r_frame_rate',
+        '-of', 'json', url,
+    ]
+    try:
+        result = subprocess.run(command, capture_output=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        raise ProbeError(f"no answer within {timeout:.0f}s")
+    except OSError as e:
+        raise ProberUnavailable(f"Can't run ffprobe: {e}")
+    if result.returncode != 0:
+        raise ProbeError(result.stderr.decode(errors='ignore').strip()[:200] or f"exit code {result.returncode}")
+
+    streams = json.loads(result.stdout or b'{}').get('streams') or []
+    if not streams:
+        raise ProbeError("no video stream")
+    video = streams[0]
+    return {
+        'codec': video.get('codec_name') or '',
+        'width': video.get('width'),
+        'height': video.get('height'),
+        'fps': _parse_rate(video.get('avg_frame_rate')) or _parse_rate(video.get('r_frame_rate')),
+    }
+
+
+def probe_source(url, preferred_transport=None, timeout=10.0):
+    """
+        Probe a source over each RTSP transport until one answers, the last known
+        working transport first. Returns the metadata plus 'transport', raises
+        ProbeError with the last failure if none does.
+    """
+    if not url.startswith(('rtsp://', 'rtsps://')):
+        return {**probe_url(url, timeout=timeout), 'transport': ''}
+
+    transports = sorted(TRANSPORTS, key=lambda transport: transport != preferred_transport)
+    error = None
+    for transport in transports:
+        try:
+            return {**probe_url(url, transport, timeout), 'transport': transport}
+        except ProbeError as e:
+            error = e
+    raise error
+
+
+class StreamProber:
+    """
+        Probes every active stream with ffprobe on a bounded thread pool and caches
+        the results on the Stream (source_* fields, probe_status, probed_at), so
+        pipelines start with the right transport and settings and dead cameras
+        aren't retried on every viewer connect.
+    """
+
+    def __init__(self, max_workers=8, timeout=10.0, interval=300.0):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.interval = interval
+        self.is_running = False
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def probe_stream(self, stream):
+        """Probe one stream and save the outcome, returns the updated field values"""
+        from ..models import Stream
+
+        try:
+            source = probe_source(stream.url, stream.source_transport or None, self.timeout)
+            fields = {
+                'source_codec': source['codec'],
+                'source_width': source['width'],
+                'source_height': source['height'],
+                'source_fps': source['fps'],
+                'source_transport': source['transport'],
+                'probe_status': Stream.PROBE_OK,
+                'probe_error': '',
+            }
+        except ProberUnavailable as e:
+            # Don't mark every camera dead because of a broken install
+            logger.error(f"Not probing stream {stream.id}: {e}")
+            return {'probe_status': Stream.PROBE_UNKNOWN, 'probe_error': str(e)[:255]}
+        except (ProbeError, ValueError) as e:
+            logger.warning(f"Probe of stream {stream.id} failed: {e}")
+            fields = {'probe_status': Stream.PROBE_UNREACHABLE, 'probe_error': str(e)[:255]}
+        fields['probed_at'] = timezone.now()
+        Stream.objects.filter(id=stream.id).update(**fields)
+        return fields
+
+    def probe_all(self, streams=None):
+        """Probe the given streams (default: all active ones) concurrently, returns {id: fields}"""
+        from ..models import Stream
+
+        if streams is None:
+            streams = list(Stream.objects.filter(is_active=True).only('id', 'url', 'source_transport'))
+        if not streams:
+            return {}
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='stream-probe') as executor:
+            results = dict(zip((stream.id for stream in streams), executor.map(self._probe_in_thread, streams)))
+        unreachable = sum(1 for fields in results.values() if fields['probe_status'] == Stream.PROBE_UNREACHABLE)
+        logger.info(f"Probed {len(results)} streams in {time.monotonic() - started:.1f}s, {unreachable} unreachable")
+        return results
+
+    def _probe_in_thread(self, stream):
+        try:
+            return self.probe_stream(stream)
+        finally:
+            # Each pool thread has its own database connection
+            close_old_connections()
+
+    def start(self):
+        """Probe all active streams now and then every interval seconds, in the background"""
+        with self._lock:
+            if self.is_running or not self.interval:
+                return
+            self.is_running = True
+            self._thread = threading.Thread(target=self._run, name='stream-prober', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while self.is_running:
+            try:
+                self.probe_all()
+            except Exception as e:
+                logger.error(f"Stream probe round failed: {e}", exc_info=True)
+            finally:
+                close_old_connections()
+            time.sleep(self.interval)
+
+
+_prober = None
+_prober_lock = threading.Lock()
+
+
+def get_stream_prober():
+    """The process-wide prober, configured from the STREAM_PROBE_* settings"""
+    global _prober
+    with _prober_lock:
+        if _prober is None:
+            _prober = StreamProber(
+                max_workers=getattr(settings, 'STREAM_PROBE_WORKERS', 8),
+                timeout=getattr(settings, 'STREAM_PROBE_TIMEOUT', 10.0),
+                interval=getattr(settings, 'STREAM_PROBE_INTERVAL', 300.0),
+            )
+    return _prober
@@ -0,0 +1,346 @@
+import os
+import queue
+import signal
+import atexit
+import threading
+import time
+import logging
+import multiprocessing
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from .frame_ring import FrameRing, RING_PREFIX, unlink_stale_rings
+from .frame_trace import FrameTrace
+from .face_gallery import get_face_gallery
+from .load_shedder import get_load_shedder
+from .pipeline_worker import worker_main
+from .rtsp_client import PREVIEW_MODE
+
+logger = logging.getLogger('worker_pool')
+
+RING_SLOTS = 64
+RING_SLOT_SIZE = 1 << 20  # 1 MiB, comfortably above a 1080p JPEG
+SUPERVISE_INTERVAL = 1.0
+# Don't restart a worker more often than this, in case it crashes on startup
+RESTART_BACKOFF = 5.0
+
+
+class ShardedStreamClient:
+    """
+        Stand-in for RTSPClient in the ASGI process when pipelines run in worker
+        processes. Tracks viewers locally, forwards lifecycle commands to the
+        worker and mirrors the worker's frame buffer and runtime status. It is
+        what the ASGI process's load shedder steps, the worker applies the level.
+    """
+
+    def __init__(self, pool, stream_id, url, group_name, config):
+        self.pool = pool
+        self.stream_id = stream_id
+        self.url = url
+        self.group_name = group_name
+        self.config = config
+        self.client_count = 0
+        self.is_running = False
+        self.frame_buffer = None
+        self.frame_buffer_trace = None
+        self.fps = config.get('fps')
+        self.status = {}
+        self.worker = None
+        self.load_shedder = get_load_shedder()
+        self.shed_level = 0
+
+    def start(self):
+        self.client_count += 1
+        if self.is_running:
+            self.worker.send(('add_client', self.stream_id))
+            return
+        self.is_running = True
+        self.shed_level = 0
+        self.worker = self.pool.assign(self)
+        self.worker.send(('start', self.stream_id, self.url, self.group_name, self.config))
+        if self.config.get('mode', 'full') != PREVIEW_MODE:
+            self.load_shedder.register(self)
+        logger.info(f"Started stream {self.stream_id} on pipeline worker {self.worker.index}")
+
+    def add_client(self):
+        self.client_count += 1
+        self.worker.send(('add_client', self.stream_id))
+
+    def remove_client(self):
+        if self.client_count > 0:
+            self.client_count -= 1
+        self.worker.send(('remove_client', self.stream_id))
+        if self.client_count == 0:
+            # The worker drains, stops ffmpeg and eventually tears the pipeline down
+            self.is_running = False
+            self.frame_buffer = None
+            self.load_shedder.unregister(self)
+            self.pool.release(self)
+
+    def reconfigure(self, url, config):
+        self.url = url
+        self.config = config
+        self.fps = config.get('fps')
+        if self.worker:
+            self.worker.send(('reconfigure', self.stream_id, url, config))
+
+    @property
+    def state(self):
+        if not self.is_running:
+            return 'idle'
+        return self.status.get('state', 'connecting')
+
+    @property
+    def priority(self):
+        return self.config.get('priority', 0)
+
+    @property
+    def has_detection(self):
+        return self.status.get('detection_enabled', self.config.get('detection_enabled', True))
+
+    @property
+    def cpu_percent(self):
+        return self.status.get('cpu_percent', 0.0)
+
+    def set_shed_level(self, level):
+        self.shed_level = level
+        self.worker.send(('set_shed_level', self.stream_id, level))
+
+    def frame_utilization(self):
+        return self.status.get('frame_utilization', 0.0)
+
+    def runtime_status(self):
+        status = {
+            'stream_id': self.stream_id,
+            'state': 'connecting',
+            'transport': None,
+            'input_fps': 0.0,
+            'output_fps': 0.0,
+            'configured_fps': self.fps,
+            'frames_read': 0,
+            'frames_suppressed': 0,
+            'frames_skipped_stale': 0,
+            'cpu_percent': 0.0,
+            'idle_seconds': None,
+            'idle_cpu_seconds': 0.0,
+            'detection_enabled': self.config.get('detection_enabled', True),
+            'started_at': None,
+            'mode': self.config.get('mode', 'full'),
+            'priority': self.priority,
+            'frames_shed': 0,
+            **self.status,
+        }
+        status.pop('ffmpeg_pid', None)
+        status.pop('frame_utilization', None)
+        # The worker's own report lags a level change by up to a status interval
+        status['shed_level'] = self.shed_level
+        if not self.is_running:
+            # Released from its worker, which no longer reports on it
+            status['state'] = 'idle'
+
+        # Viewers are counted here, the worker only knows about forwarded joins
+        status['viewers'] = self.client_count
+        status['worker'] = self.worker.index if self.worker else None
+        return status
+
+
+class _Worker:
+    """One pipeline worker process with its command queue, event queue and frame ring"""
+
+    def __init__(self, pool, index):
+        self.pool = pool
+        self.index = index
+        self.generation = 0
+        self.clients = {}  # stream_id -> ShardedStreamClient
+        self.process = None
+        self.ring = None
+        self.commands = None
+        self.events = None
+        self.reader = None
+        self.started_at = 0
+
+    def spawn(self):
+        context = self.pool.context
+        self.generation += 1
+        self.ring = FrameRing(
+            f"{RING_PREFIX}{os.getpid()}_{self.index}_{self.generation}",
+            RING_SLOTS, RING_SLOT_SIZE, create=True
+        )
+        self.commands = context.Queue()
+        self.events = context.Queue()
+        self.process = context.Process(
+            target=worker_main,
+            args=(self.index, self.ring.name, RING_SLOTS, RING_SLOT_SIZE, self.commands, self.events),
+            name=f"pipeline-worker-{self.index}",
+            daemon=True,
+        )
+        self.process.start()
+        self.started_at = time.monotonic()
+        self.reader = threading.Thread(target=self._read_events, args=(self.events, self.ring), daemon=True)
+        self.reader.start()
+        logger.info(f"Pipeline worker {self.index} spawned (PID: {self.process.pid}, generation {self.generation})")
+
+    def send(self, command):
+        try:
+            self.commands.put(command)
+        except Exception as e:
+            logger.error(f"Failed to send {command[0]} to pipeline worker {self.index}: {e}")
+
+    def _read_events(self, events, ring):
+        channel_layer = get_channel_layer()
+        generation = self.generation
+        while self.pool.is_running and generation == self.generation:
+            try:
+                stream_id, event = events.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                break
+
+            if event['type'] == 'face_embeddings':
+                get_face_gallery().observe(stream_id, event['embeddings'])
+                continue
+
+            client = self.clients.get(stream_id)
+            if client is None:
+                continue
+
+            if event['type'] == 'pipeline_status':
+                client.status = event['status']
+                continue
+
+            if event['type'] == 'stream_frame':
+                frame = ring.read(event.pop('slot'), event.pop('ring_seq'))
+                if frame is None:
+                    # Slot was reused before we got to it, a newer frame is on its way
+                    continue
+                event['frame'] = frame
+                client.frame_buffer = frame
+                client.frame_buffer_trace = FrameTrace(event['seq'], event['trace'])
+
+            try:
+                async_to_sync(channel_layer.group_send)(client.group_name, event)
+            except Exception as e:
+                logger.error(f"Error relaying {event['type']} for {stream_id}: {str(e)}")
+
+    def is_alive(self):
+        return self.process is not None and self.process.is_alive()
+
+    def cleanup(self):
+        """Release resources of a dead worker, including ffmpeg processes it left behind"""
+        for client in self.clients.values():
+            ffmpeg_pid = client.status.get('ffmpeg_pid')
+            if ffmpeg_pid:
+                try:
+                    # ffmpeg runs in its own session (os.setsid), so its pid is the group id
+                    os.killpg(ffmpeg_pid, signal.SIGTERM)
+                except (ProcessLookupError, PermissionError):
+                    pass
+            client.status = {}
+        if self.ring:
+            self.ring.close(unlink=True)
+            self.ring = None
+
+    def restart(self):
+        logger.error(f"Pipeline worker {self.index} died (exit code {self.process.exitcode}), restarting")
+        self.cleanup()
+        self.spawn()
+        for client in self.clients.values():
+            if client.client_count == 0:
+                continue
+            self.send(('start', client.stream_id, client.url, client.group_name, client.config))
+            for _ in range(client.client_count - 1):
+                self.send(('add_client', client.stream_id))
+            if client.shed_level:
+                self.send(('set_shed_level', client.stream_id, client.shed_level))
+
+    def shutdown(self):
+        if self.is_alive():
+            self.send(('shutdown',))
+            self.process.join(timeout=5.0)
+            if self.process.is_alive():
+                self.process.kill()
+        self.cleanup()
+
+
+class PipelineWorkerPool:
+    """
+        Shards stream pipelines across worker processes so ffmpeg parsing, MTCNN
+        and JPEG encoding aren't bound by the ASGI process's GIL. Frames come back
+        through a shared memory ring per worker. Crashed workers are restarted
+        and their streams resumed, the ASGI process keeps serving throughout.
+    """
+
+    def __init__(self, process_count):
+        self.context = multiprocessing.get_context('spawn')
+        # A killed ASGI process (SIGKILL, no atexit) leaves its rings in /dev/shm
+        stale = unlink_stale_rings()
+        if stale:
+            logger.warning(f"Removed {len(stale)} frame rings left behind by dead processes")
+        self.is_running = True
+        self.lock = threading.Lock()
+        self.workers = [_Worker(self, index) for index in range(process_count)]
+        # Last worker each stream ran on, so a returning viewer resumes the idle pipeline there
+        self.placements = {}
+        for worker in self.workers:
+            worker.spawn()
+        self.supervisor = threading.Thread(target=self._supervise, daemon=True)
+        self.supervisor.start()
+        atexit.register(self.shutdown)
+
+    def create_client(self, stream_id, url, group_name, config):
+        return ShardedStreamClient(self, stream_id, url, group_name, config)
+
+    def assign(self, client):
+        """Place a stream on its previous worker, or else the one with the fewest streams"""
+        with self.lock:
+            worker = self.placements.get(client.stream_id)
+            if worker is None:
+                worker = min(self.workers, key=lambda w: len(w.clients))
+            worker.clients[client.stream_id] = client
+            self.placements[client.stream_id] = worker
+        return worker
+
+    def release(self, client):
+        with self.lock:
+            if client.worker and client.worker.clients.get(client.stream_id) is client:
+                del client.worker.clients[client.stream_id]
+
+    def _supervise(self):
+        while self.is_running:
+            time.sleep(SUPERVISE_INTERVAL)
+            for worker in self.workers:
+                if not self.is_running or worker.is_alive():
+                    continue
+                if time.monotonic() - worker.started_at < RESTART_BACKOFF:
+                    continue
+                try:
+                    with self.lock:
+                        worker.restart()
+                except Exception as e:
+                    logger.error(f"Failed to restart pipeline worker {worker.index}: {e}", exc_info=True)
+
+    def shutdown(self):
+        if not self.is_running:
+            return
+        self.is_running = False
+        for worker in self.workers:
+            worker.shutdown()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_worker_pool():
+    """The process-wide pool, or None when STREAM_WORKER_PROCESSES is 0 (pipelines run as threads)"""
+    global _pool
+    process_count = getattr(settings, 'STREAM_WORKER_PROCESSES', 0)
+    if not process_count:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = PipelineWorkerPool(process_count)
+    return _pool
@@ -1,11 +1,28 @@
+import threading
+import time
+
+import numpy as np
+import PIL.Image as Image
 from django.shortcuts import render
+from django.db import transaction
+from django.utils import timezone
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from .models import Stream
-from .serializers import StreamSerializer
+from .serializers import (
+    StreamSerializer, StreamIdsSerializer, StreamRuntimeStatusSerializer,
+    FaceSearchSerializer, FaceIdentitySerializer, FaceGallerySummarySerializer, FaceSearchResultSerializer,
+)
+from .pagination import StreamCursorPagination
+from .consumer import active_streams, pipeline_key
+from .utils.rtsp_client import PREVIEW_MODE
+from .utils.face_gallery import get_face_gallery
+from .utils.load_shedder import get_load_shedder
+from .utils.face_embedder import FaceEmbedder
+from .utils.mtcnn_detector import MTCNNDetector
 # from .utils.stream_manager import StreamManager
-from drf_spectacular.utils import extend_schema, extend_schema_view
+from drf_spectacular.utils import extend_schema, extend_schema_view, OpenApiParameter
 
 # Create your views here.
 
@@ -24,6 +41,24 @@ class StreamViewSet(viewsets.ModelViewSet):
     """
     queryset = Stream.objects.all()
     serializer_class = StreamSerializer
+    pagination_class = StreamCursorPagination
+
+    MAX_BULK_SIZE = 1000
+
+    def perform_update(self, serializer):
+        if serializer.validated_data.get('url', serializer.instance.url) != serializer.instance.url:
+            # Cached source metadata belongs to the old URL
+            stream = serializer.save(
+                source_codec='', source_width=None, source_height=None, source_fps=None,
+                source_transport='', probe_status=Stream.PROBE_UNKNOWN, probe_error='', probed_at=None,
+            )
+        else:
+            stream = serializer.save()
+        # Apply the new settings to the running pipelines, viewers stay connected
+        for mode in ('full', PREVIEW_MODE):
+            client = active_streams.get(pipeline_key(str(stream.id), mode))
+            if client:
+                client.reconfigure(stream.url, stream.pipeline_config(mode))
     
     @extend_schema(
         description="Activate a stream",
@@ -64,5 +99,158 @@ class StreamViewSet(viewsets.ModelViewSet):
     def active(self, request):
         """Get all active streams"""
         active_streams = Stream.objects.filter(is_active=True)
-        serializer = self.get_serializer(active_streams, many=True)
-        return Response(serializer.data)
+        page = self.paginate_queryset(active_streams)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @extend_schema(
+        description="Create many streams in one request",
+        request=StreamSerializer(many=True),
+        responses={201: StreamSerializer(many=True)}
+    )
+    @action(detail=False, methods=['post'], url_path='bulk')
+    def bulk_create(self, request):
+        """Create a list of streams with a single bulk insert"""
+        if not isinstance(request.data, list) or not 0 < len(request.data) <= self.MAX_BULK_SIZE:
+            return Response(
+                {'detail': f'Expected a list of 1 to {self.MAX_BULK_SIZE} streams.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        serializer = self.get_serializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            streams = Stream.objects.bulk_create(
+                [Stream(**item) for item in serializer.validated_data],
+                batch_size=500
+            )
+        return Response(self.get_serializer(streams, many=True).data, status=status.HTTP_201_CREATED)
+
+    def _bulk_set_active(self, request, is_active):
+        serializer = StreamIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        # update() skips auto_now, so set updated_at explicitly
+        updated = Stream.objects.filter(id__in=serializer.validated_data['ids']).update(
+            is_active=is_active,
+            updated_at=timezone.now()
+        )
+        return Response({'updated': updated})
+
+    @extend_schema(
+        description="Activate many streams by id",
+        request=StreamIdsSerializer,
+        responses={200: {'type': 'object', 'properties': {'updated': {'type': 'integer'}}}}
+    )
+    @action(detail=False, methods=['post'], url_path='bulk-activate')
+    def bulk_activate(self, request):
+        """Activate a list of streams with a single UPDATE"""
+        return self._bulk_set_active(request, True)
+
+    @extend_schema(
+        description="Deactivate many streams by id",
+        request=StreamIdsSerializer,
+        responses={200: {'type': 'object', 'properties': {'updated': {'type': 'integer'}}}}
+    )
+    @action(detail=False, methods=['post'], url_path='bulk-deactivate')
+    def bulk_deactivate(self, request):
+        """Deactivate a list of streams with a single UPDATE"""
+        return self._bulk_set_active(request, False)
+
+    @extend_schema(
+        description="Runtime state of all running stream pipelines",
+        responses={200: StreamRuntimeStatusSerializer(many=True)}
+    )
+    @action(detail=False, methods=['get'], url_path='runtime-status', pagination_class=None)
+    def runtime_status(self, request):
+        """Viewer counts, fps and pipeline state read from the live pipelines, no database access"""
+        statuses = [client.runtime_status() for client in list(active_streams.values())]
+        return Response(StreamRuntimeStatusSerializer(statuses, many=True).data)
+
+    @extend_schema(
+        description="Load shedding state: host CPU, current shed level per stream and recent decisions"
+    )
+    @action(detail=False, methods=['get'], url_path='load-shedding', pagination_class=None)
+    def load_shedding(self, request):
+        """What the load shedder has taken away from which stream and why, newest decision first"""
+        snapshot = get_load_shedder().snapshot()
+        snapshot['streams'] = [
+            {key: status[key] for key in ('stream_id', 'state', 'priority', 'shed_level', 'frames_shed',
+                                          'output_fps', 'cpu_percent')}
+            for status in (client.runtime_status() for client in list(active_streams.values()))
+        ]
+        return Response(snapshot)
+
+
+# Detector and embedder for search-by-image requests, created on first use
+_search_models = None
+_search_lock = threading.Lock()
+
+
+def _embed_largest_face(image_file):
+    """Embedding of the largest face in an uploaded image, None if there is none"""
+    global _search_models
+    image_array_rgb = np.ascontiguousarray(np.array(Image.open(image_file).convert('RGB')), dtype=np.uint8)
+    with _search_lock:
+        if _search_models is None:
+            _search_models = (MTCNNDetector(), FaceEmbedder.from_settings())
+        detector, embedder = _search_models
+        if detector.detector is None or embedder is None:
+            return None
+        faces = detector.find_faces(image_array_rgb)
+        if not faces:
+            return None
+        largest = max(faces, key=lambda face: face[2] * face[3])
+        embeddings = embedder.embed(image_array_rgb, [largest])
+    return embeddings[0] if len(embeddings) else None
+
+
+class FaceGalleryViewSet(viewsets.ViewSet):
+    """
+    API endpoint for the face gallery built from streams with embeddings enabled.
+    Looks up the nearest known identities for an embedding or an image.
+    """
+
+    # Not a list of identities, so the operation id is set to keep it apart from retrieve
+    @extend_schema(description="Face gallery size", operation_id='faces_summary',
+                   responses={200: FaceGallerySummarySerializer})
+    def list(self, request):
+        gallery = get_face_gallery()
+        return Response({'count': len(gallery), 'dim': gallery.dim})
+
+    @extend_schema(description="Retrieve a known identity and the streams it was seen on",
+                   parameters=[OpenApiParameter('id', int, OpenApiParameter.PATH)],
+                   responses={200: FaceIdentitySerializer})
+    def retrieve(self, request, pk=None):
+        identity = get_face_gallery().identity(int(pk)) if str(pk).isdigit() else None
+        if identity is None:
+            return Response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(FaceIdentitySerializer(identity).data)
+
+    @extend_schema(description="Find the nearest known faces for an embedding or the largest face in an image",
+                   request=FaceSearchSerializer, responses={200: FaceSearchResultSerializer})
+    @action(detail=False, methods=['post'])
+    def search(self, request):
+        """Nearest identities by cosine similarity"""
+        serializer = FaceSearchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        gallery = get_face_gallery()
+
+        if 'image' in serializer.validated_data:
+            embedding = _embed_largest_face(serializer.validated_data['image'])
+            if embedding is None:
+                return Response({'detail': 'No face found, or no embedding model configured.'},
+                                status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        else:
+            embedding = np.asarray(serializer.validated_data['embedding'], dtype=np.float32)
+            if embedding.shape[0] != gallery.dim:
+                return Response({'detail': f'Embedding must have {gallery.dim} dimensions.'},
+                                status=status.HTTP_400_BAD_REQUEST)
+
+        started = time.perf_counter()
+        matches = gallery.search(embedding, k=serializer.validated_data['k'])[0]
+        took_ms = (time.perf_counter() - started) * 1000
+
+        results = []
+        for identity_id, similarity in matches:
+            identity = gallery.identity(identity_id)
+            results.append({**FaceIdentitySerializer(identity).data, 'similarity': similarity})
+        return Response({'results': results, 'took_ms': round(took_ms, 3)})
@@ -5,14 +5,22 @@ import { Badge } from '../ui/badge';
 import { Play, Pause, RefreshCw, Maximize, Minimize, Video, VideoOff, X } from 'lucide-react';
 import { cn } from '@/lib/utils';
 import { SOCKET_BASE_URL } from '@/config';
+import { parseFrame } from '@/lib/frame';
 
 interface StreamViewerProps {
   streamId: string;
   streamName: string;
   baseUrl?: string;
+  // Ask the server for at most this many frames per second, e.g. for small tiles
+  maxFps?: number;
+  // Keyframe-only thumbnails without face detection, for overviews
+  preview?: boolean;
   removeStream: () => void;
 }
 
+// Frame rate requested while the tab is in the background
+const HIDDEN_MAX_FPS = 1;
+
 interface StreamFrame {
   type: string;
   frame?: string;
@@ -24,6 +32,8 @@ const StreamViewer: React.FC<StreamViewerProps> = ({
   streamId, 
   streamName,
   baseUrl = SOCKET_BASE_URL,
+  maxFps,
+  preview = false,
   removeStream
 }) => {
   const [isConnected, setIsConnected] = useState(false);
@@ -85,7 +95,11 @@ const StreamViewer: React.FC<StreamViewerProps> = ({
 
     // Create new WebSocket connection
     // Use path without ws/ prefix to match backend routes
-    const ws = new WebSocket(`${baseUrl}/stream/${streamId}/`);
+    const params = new URLSearchParams();
+    if (maxFps) params.set('max_fps', String(maxFps));
+    if (preview) params.set('mode', 'preview');
+    const query = params.toString() ? `?${params}` : '';
+    const ws = new WebSocket(`${baseUrl}/stream/${streamId}/${query}`);
     wsRef.current = ws;
 
     ws.onopen = () => {
@@ -101,7 +115,8 @@ const StreamViewer: React.FC<StreamViewerProps> = ({
         // Check if the data is a Blob (which it is, based on your log)
         if (event.data instanceof Blob) {
           const buffer = await event.data.arrayBuffer(); // Read Blob as ArrayBuffer
-          const bytes = new Uint8Array(buffer);
+          // Strip the latency trace header, only the JPEG goes to the queue
+          const { jpeg: bytes } = parseFrame(new Uint8Array(buffer));
           setFrameQueue(prevQueue => {
             const newQueue = [...prevQueue, bytes];
             if (newQueue.length > STREAM_FRAMES.current * 2) newQueue.shift();
@@ -177,6 +192,24 @@ const StreamViewer: React.FC<StreamViewerProps> = ({
     }
   };
 
+  // A background tab only needs the occasional frame
+  useEffect(() => {
+    const handleVisibilityChange = () => {
+      const ws = wsRef.current;
+      if (!ws || ws.readyState !== WebSocket.OPEN) return;
+      ws.send(JSON.stringify({
+        type: 'set_max_fps',
+        max_fps: document.hidden ? HIDDEN_MAX_FPS : (maxFps ?? 0),
+      }));
+    };
+
+    document.addEventListener('visibilitychange', handleVisibilityChange);
+
+    return () => {
+      document.removeEventListener('visibilitychange', handleVisibilityChange);
+    };
+  }, [maxFps]);
+
   // Handle fullscreen change
   useEffect(() => {
     const handleFullscreenChange = () => {
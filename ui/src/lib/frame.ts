@@ -0,0 +1,38 @@
+// Binary frame header written by stream/utils/frame_trace.py:
+//   magic "RT" | version u8 | stage count u8 | sequence u32 | stage count x monotonic ns u64
+export const FRAME_STAGES = ['read', 'split', 'detect', 'encode', 'enqueue', 'sent'] as const;
+
+export interface FrameTrace {
+  seq: number;
+  // Nanosecond monotonic stamps per stage, 0n when the stage was skipped
+  stamps: bigint[];
+}
+
+export interface ParsedFrame {
+  jpeg: Uint8Array;
+  trace: FrameTrace | null;
+}
+
+export function parseFrame(bytes: Uint8Array): ParsedFrame {
+  // "RT" magic, JPEG data always starts with 0xFF 0xD8 so there is no ambiguity
+  if (bytes.length < 8 || bytes[0] !== 0x52 || bytes[1] !== 0x54) {
+    return { jpeg: bytes, trace: null };
+  }
+  const view = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength);
+  const stageCount = bytes[3];
+  const headerSize = 8 + 8 * stageCount;
+  const stamps: bigint[] = [];
+  for (let i = 0; i < stageCount; i++) {
+    stamps.push(view.getBigUint64(8 + 8 * i));
+  }
+  return {
+    jpeg: bytes.subarray(headerSize),
+    trace: { seq: view.getUint32(4), stamps },
+  };
+}
+
+// Frames on the multiplexed ws/streams/ endpoint carry a u16 subscription tag in front of the header
+export function parseMultiplexedFrame(bytes: Uint8Array): ParsedFrame & { tag: number } {
+  const tag = (bytes[0] << 8) | bytes[1];
+  return { tag, ...parseFrame(bytes.subarray(2)) };
+}